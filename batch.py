@@ -0,0 +1,206 @@
+"""Headless batch mode: generate plans for many brain dumps from a JSONL or CSV file.
+
+    python batch.py inputs.jsonl plans.jsonl --concurrency 8 --granularity 2
+    python batch.py inputs.csv plans.jsonl --id-field participant --text-field brain_dump
+    python batch.py inputs.jsonl requests.jsonl --prepare-batch
+    python batch.py batch_output.jsonl plans.jsonl --import-batch
+
+Inputs are read as a stream (JSONL objects or CSV rows with an id and a text
+field). Each plan is appended to the output JSONL as soon as it's ready, and
+inputs whose id already has a plan there are skipped, so an interrupted run can
+simply be started again. --prepare-batch writes OpenAI Batch API request lines
+instead of calling the API, and --import-batch turns the Batch API's output file
+into plans. The API key comes from OPENAI_API_KEY (or .env).
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlit import config
+from streamlit.logger import set_log_level
+from unstuck_core import (
+    TASK_MODES, breakdown_temperature, build_prompts, cached_task_breakdown, cached_validation, get_openai_client,
+    guessed_output_tokens, init_session_state, parse_json_response, route_model, timed_stage,
+)
+
+def iter_inputs(path, id_field, text_field):
+    """Yield (id, text) from a JSONL or CSV file without loading it all; ids default to the line/row number"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for number, row in enumerate(rows, 1):
+            text = (row.get(text_field) or "").strip()
+            if text:
+                yield str(row.get(id_field) or number), text
+
+def finished_ids(output_path, id_key="id"):
+    """Ids that already have a plan in the output file (failed ones are retried)"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A line cut off when the last run was interrupted
+            if "error" not in record:
+                done.add(record[id_key])
+    return done
+
+def task_to_dict(task):
+    return {
+        "task": task.title,
+        # Labels are markdown for the app, where robotic steps' numbers are escaped
+        "sections": {header: [re.sub(r"^(\d+)\\\.", r"\1.", label) for _, label in steps] for header, steps in task.sections},
+        "activation_hack": task.hack,
+    }
+
+def plan_one(client, record_id, text, granularity_level, validate):
+    """Plan one brain dump the way the app does; returns an output record (with "error" on failure)"""
+    start = time.perf_counter()
+    try:
+        validation = cached_validation(client, text, timed_stage) if validate else None
+        # Near-duplicate reuse is for one user editing a dump; participants must never get each other's plans
+        content = cached_task_breakdown(client, text, TASK_MODES, granularity_level, timed=timed_stage, semantic=False)
+        tasks = parse_json_response(content)
+        if not tasks:
+            raise ValueError("the response wasn't valid JSON")
+        return {"id": record_id, "input": text, "granularity_level": granularity_level, "validation": validation,
+                "tasks": [task_to_dict(task) for task in tasks], "seconds": round(time.perf_counter() - start, 2)}
+    except Exception as e:
+        return {"id": record_id, "input": text, "error": str(e)}
+
+class Progress:
+    """Counts finished inputs and reports throughput in inputs per minute"""
+
+    def __init__(self, report_every):
+        self.report_every = report_every
+        self.start = time.perf_counter()
+        self.done = 0
+        self.failed = 0
+
+    def record(self, result):
+        self.done += 1
+        self.failed += "error" in result
+        if self.report_every and self.done % self.report_every == 0:
+            self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.done / elapsed * 60 if elapsed else 0.0
+        print(f"{self.done} inputs ({self.failed} failed) in {elapsed:.1f}s: {rate:.1f} inputs/min", file=sys.stderr)
+
+def run_batch(args):
+    """Plan every unfinished input with bounded concurrency, appending results as they finish"""
+    done = finished_ids(args.output)
+    if done:
+        print(f"Resuming: {len(done)} inputs already planned", file=sys.stderr)
+    client = get_openai_client()
+    progress = Progress(args.report_every)
+    write_lock = threading.Lock()
+    # Bounds both the work in flight and how far ahead of it the input stream is read
+    slots = threading.BoundedSemaphore(args.concurrency * 2)
+
+    with open(args.output, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="batch") as executor:
+        def finish(future):
+            try:
+                result = future.result()
+                with write_lock:
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    out.flush()  # Every finished plan is a checkpoint
+                    progress.record(result)
+            finally:
+                slots.release()
+
+        for record_id, text in iter_inputs(args.input, args.id_field, args.text_field):
+            if record_id in done:
+                continue
+            slots.acquire()
+            executor.submit(plan_one, client, record_id, text, args.granularity, not args.no_validation).add_done_callback(finish)
+    progress.report()
+    return 1 if progress.failed else 0
+
+def prepare_batch(args):
+    """Write one Batch API request line per input (task breakdowns only), without calling the API"""
+    count = 0
+    with open(args.output, "w", encoding="utf-8") as out:
+        for record_id, text in iter_inputs(args.input, args.id_field, args.text_field):
+            system_prompt, user_prompt = build_prompts(text, TASK_MODES, args.granularity)
+            body = {
+                "model": route_model(f"breakdown_{args.granularity}"),
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                "temperature": breakdown_temperature(TASK_MODES),
+                "max_tokens": guessed_output_tokens(args.granularity, text),
+                "response_format": {"type": "json_object"},
+            }
+            request = {"custom_id": record_id, "method": "POST", "url": "/v1/chat/completions", "body": body}
+            out.write(json.dumps(request, ensure_ascii=False) + "\n")
+            count += 1
+    print(f"Wrote {count} Batch API requests to {args.output}", file=sys.stderr)
+    return 0
+
+def import_batch(args):
+    """Turn a Batch API output file into plan records, skipping ids already in the output"""
+    done = finished_ids(args.output)
+    progress = Progress(args.report_every)
+    with open(args.input, encoding="utf-8") as f, open(args.output, "a", encoding="utf-8") as out:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            record_id = item["custom_id"]
+            if record_id in done:
+                continue
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                result = {"id": record_id, "error": str(item.get("error") or response.get("body"))}
+            else:
+                tasks = parse_json_response(response["body"]["choices"][0]["message"]["content"])
+                result = ({"id": record_id, "tasks": [task_to_dict(task) for task in tasks]} if tasks
+                          else {"id": record_id, "error": "the response wasn't valid JSON"})
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            progress.record(result)
+    progress.report()
+    return 1 if progress.failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL or CSV brain dumps (or a Batch API output file with --import-batch)")
+    parser.add_argument("output", help="JSONL file results are appended to")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--granularity", type=int, default=2, choices=(1, 2, 3))
+    parser.add_argument("--concurrency", type=int, default=4, help="inputs planned at the same time")
+    parser.add_argument("--no-validation", action="store_true", help="skip the emotion check and validation message")
+    parser.add_argument("--report-every", type=int, default=10, help="print throughput every N inputs")
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument("--prepare-batch", action="store_true", help="write Batch API requests instead of calling the API")
+    modes.add_argument("--import-batch", action="store_true", help="read a Batch API output file into plans")
+    args = parser.parse_args()
+
+    # Streamlit warns about every call made outside `streamlit run`; its config sets
+    # log levels when first parsed, so parse it before quietening the loggers
+    config.get_option("logger.level")
+    set_log_level("error")
+    init_session_state()  # log_entry keeps its records in (bare-mode) session state
+    if args.prepare_batch:
+        return prepare_batch(args)
+    if args.import_batch:
+        return import_batch(args)
+    return run_batch(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""Local stand-in for the OpenAI chat completions API, for offline benchmarks.
+
+Answers every kind of request app.py makes (emotion check, validation, task
+extraction, task breakdowns, single-shot and continuation requests), streamed or
+not, with a configurable latency, streaming chunk size and fault mode.
+
+    server = FakeOpenAIServer(latency=0.3, chunk_size=40, tasks=5, steps=6)
+    server.start()
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAULTS = ("none", "malformed", "truncated")
+
+def build_task_map(tasks, steps):
+    """A task map in the app's example format with `tasks` tasks of `steps` robotic steps each"""
+    return {
+        f'Task: "Task {i}"': {
+            "Robotic Mode (For Overwhelm)": [f"{j}. **Do** step {j} of task {i}" for j in range(1, steps + 1)],
+            "Creative Mode (Make It Fun)": ["🎮 *Turn it into a game*", "🎵 *Put on a playlist*"],
+            "Activation Hack": '"Just start with step 1"',
+        }
+        for i in range(1, tasks + 1)
+    }
+
+def break_json(content):
+    """Make valid JSON malformed the way models do: trailing commas and a stray escape"""
+    return content.replace("]", ",]", 1).replace("}", ",}", 1).replace("Just start", "Just \\start", 1)
+
+class FakeOpenAIServer:
+    """Threaded HTTP server speaking enough of /v1/chat/completions for app.py.
+
+    latency is the delay before the first byte, chunk_size the characters per
+    streamed delta (chunk_delay seconds apart). fault is "none", "malformed"
+    (trailing commas, bad escapes) or "truncated" (the breakdown stops halfway
+    and a continuation request gets the rest).
+    """
+
+    def __init__(self, latency=0.3, chunk_size=40, chunk_delay=0.005, tasks=5, steps=6, fault="none", port=0):
+        if fault not in FAULTS:
+            raise ValueError(f"fault must be one of {FAULTS}")
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.fault = fault
+        self.task_map = build_task_map(tasks, steps)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.port = port
+        self.httpd = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}/v1"
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", self.port), self.handler_class())
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="fake-openai", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def respond(self, body):
+        """Content the model would have answered for this request"""
+        system_prompt = body["messages"][0]["content"]
+        prompt = body["messages"][-1]["content"]
+        if "emotion detector" in system_prompt:
+            return "negative"
+        if "extract tasks" in system_prompt:
+            return json.dumps({"tasks": [name.split('"')[1] for name in self.task_map]})
+        if "coach who specializes" in system_prompt and not body.get("response_format"):
+            return "That sounds like a lot to carry. You're not behind, you're just overloaded - one small step is enough."
+        if "this one task" in prompt:
+            name = prompt.split('this one task: "', 1)[1].split('"', 1)[0]
+            content = json.dumps({f'Task: "{name}"': next(iter(self.task_map.values()))})
+        elif "exactly these keys" in prompt:
+            content = json.dumps({"emotion": "negative", "validation": "You've got this, one step at a time.",
+                                  "tasks": self.task_map})
+        else:
+            content = json.dumps(self.task_map, ensure_ascii=False)
+            if self.fault == "truncated":
+                continuing = any(message["role"] == "assistant" for message in body["messages"])
+                return content[len(content) // 2:] if continuing else content[:len(content) // 2]
+        return break_json(content) if self.fault == "malformed" else content
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+                with server.lock:
+                    server.requests += 1
+                content = server.respond(body)
+                usage = {"prompt_tokens": sum(len(m["content"]) // 4 for m in body["messages"]),
+                         "completion_tokens": len(content) // 4}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                time.sleep(server.latency)
+                if body.get("stream"):
+                    self.stream(body["model"], content, usage)
+                else:
+                    self.send_json({
+                        "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                        "usage": usage,
+                    })
+
+            def send_json(self, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def stream(self, model, content, usage):
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.send_header("transfer-encoding", "chunked")
+                self.end_headers()
+
+                def event(choices, **extra):
+                    payload = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                               "model": model, "choices": choices, **extra}
+                    data = f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+
+                for start in range(0, len(content), server.chunk_size):
+                    event([{"index": 0, "delta": {"content": content[start:start + server.chunk_size]}, "finish_reason": None}])
+                    time.sleep(server.chunk_delay)
+                event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                event([], usage=usage)
+                done = b"data: [DONE]\n\n"
+                self.wfile.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+
+        return Handler
@@ -0,0 +1,201 @@
+"""Offline benchmarks for the submission flow of app.py.
+
+Drives the app headlessly with Streamlit's AppTest against a local fake
+OpenAI-compatible server (see fake_openai.py), so no API key or network is needed.
+
+Reports:
+  - end-to-end submit latency (cold, and warm from the response cache)
+  - the same with malformed and truncated model output
+  - full rerun time with N tasks x M steps on screen, plain and after a checkbox click
+  - memory held per session after a submission
+  - whether known near-duplicate pairs would reuse a whole plan (exits 1 if one is wrong)
+
+    python benchmarks/run_benchmarks.py --runs 5 --tasks 10 --steps 8 --latency 0.5
+    python benchmarks/run_benchmarks.py --strategy fan_out --chunk-size 10 --json results.json
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from fake_openai import FakeOpenAIServer
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+# `streamlit run` puts the app's folder on sys.path for its imports; AppTest doesn't
+sys.path.insert(0, os.path.dirname(APP_PATH))
+BRAIN_DUMP = "need to do taxes, call mom, fix bike, learn piano... I feel so overwhelmed"
+# The app's default SEMANTIC_CACHE_THRESHOLD (these runs raise it unless --semantic is given)
+SEMANTIC_THRESHOLD = 0.9
+# (earlier dump, new dump, whether the new one may reuse the earlier one's whole plan)
+NEAR_DUPLICATE_CASES = [
+    ("need to do taxes, call mom", "call mom + taxes", True),
+    ("need to do taxes, call mom", "gotta do my taxes & call mom", True),
+    ("taxes, call mom, fix bike, learn piano, clean room, reply to emails, book dentist, water plants",
+     "taxes, call mom, fix bike, learn piano, clean room, reply to emails, book dentist, water plants, buy milk", False),
+    ("taxes, call mom, fix bike, learn piano, clean room, reply to emails, book dentist, water plants",
+     "taxes, call mom, fix bike, learn guitar, clean room, reply to emails, book dentist, water plants", False),
+]
+
+def summarize(name, samples):
+    """Latency summary row for a list of seconds"""
+    ordered = sorted(samples)
+    def pct(q):
+        return ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))]
+    return {"benchmark": name, "runs": len(ordered), "mean_s": sum(ordered) / len(ordered),
+            "p50_s": pct(0.5), "p95_s": pct(0.95), "max_s": ordered[-1]}
+
+def new_session(args):
+    """A fresh AppTest session with the sidebar set up for this benchmark"""
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    at.secrets["OPENAI_API_KEY"] = "sk-benchmark"
+    at.run()
+    at.toggle[0].set_value(not args.no_stream)
+    at.radio[0].set_value(args.strategy)
+    at.slider[0].set_value(args.granularity)
+    return at.run()
+
+def submit(at, user_input):
+    """Submit a brain dump, wait for its background job and return (seconds, number of tasks shown)"""
+    at.text_area[0].input(user_input)
+    start = time.perf_counter()
+    at.button[0].click().run()
+    # The click only starts the job; a browser would poll it with the progress fragment
+    while at.session_state["active_job"] is not None and not at.exception:
+        time.sleep(0.05)
+        at.run()
+    elapsed = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(f"App raised: {at.exception[0].message}")
+    return elapsed, len(at.session_state["last_tasks"] or [])
+
+def bench_submit(args, server, fault, label):
+    """End-to-end latency of cold submissions (unique inputs), then one warm repeat"""
+    server.fault = fault
+    at = new_session(args)
+    cold, task_counts = [], set()
+    for run in range(args.runs):
+        elapsed, task_count = submit(at, f"[{label} {run} {time.time_ns()}] {BRAIN_DUMP}")
+        cold.append(elapsed)
+        task_counts.add(task_count)
+    warm, _ = submit(at, at.text_area[0].value)
+    rows = [summarize(f"submit ({label}, cold)", cold), summarize(f"submit ({label}, cached)", [warm])]
+    rows[0]["tasks_shown"] = sorted(task_counts)
+    return rows
+
+def bench_rerun(args, server):
+    """Time full reruns with the plan on screen: plain reruns and checkbox clicks"""
+    server.fault = "none"
+    at = new_session(args)
+    submit(at, f"[rerun {time.time_ns()}] {BRAIN_DUMP}")
+    plain, toggles = [], []
+    for run in range(args.runs):
+        start = time.perf_counter()
+        at.run()
+        plain.append(time.perf_counter() - start)
+    # Steps only get checkboxes once their task is expanded
+    next(button for button in at.button if (button.key or "").startswith("task_header_")).click().run()
+    for run in range(min(args.runs, len(at.checkbox))):
+        start = time.perf_counter()
+        at.checkbox[run].check().run()
+        toggles.append(time.perf_counter() - start)
+    label = f"{args.tasks} tasks x {args.steps} steps"
+    rows = [summarize(f"rerun ({label})", plain)]
+    if toggles:
+        rows.append(summarize(f"checkbox rerun ({label})", toggles))
+    return rows
+
+def bench_memory(args, server):
+    """Average memory allocated and still held per session after one submission"""
+    server.fault = "none"
+    submit(new_session(args), f"[memory warm-up {time.time_ns()}] {BRAIN_DUMP}")  # shared resources, imports
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    sessions = []
+    for run in range(args.sessions):
+        at = new_session(args)
+        submit(at, f"[memory {run} {time.time_ns()}] {BRAIN_DUMP}")
+        sessions.append(at)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    held = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return [{"benchmark": f"memory per session ({args.tasks} tasks x {args.steps} steps)",
+             "runs": args.sessions, "kib_per_session": held / args.sessions / 1024}]
+
+def check_near_duplicates():
+    """Whole-plan reuse decisions for NEAR_DUPLICATE_CASES, as the near-duplicate cache would make them"""
+    from unstuck_core import embed_text, same_task_list
+    rows = []
+    for earlier, new, expected in NEAR_DUPLICATE_CASES:
+        similarity = float(embed_text(earlier) @ embed_text(new))
+        reused = similarity >= SEMANTIC_THRESHOLD and same_task_list(new, earlier, SEMANTIC_THRESHOLD)
+        rows.append({"benchmark": f"near-duplicate reuse ({new[-30:]})", "similarity": similarity,
+                     "expected": expected, "reused": reused})
+    return rows
+
+def print_rows(rows):
+    for row in rows:
+        values = ", ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                           for key, value in row.items() if key != "benchmark")
+        print(f"{row['benchmark']:<45} {values}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="submissions/reruns per benchmark")
+    parser.add_argument("--sessions", type=int, default=5, help="sessions for the memory benchmark")
+    parser.add_argument("--tasks", type=int, default=5, help="tasks in each fake plan")
+    parser.add_argument("--steps", type=int, default=6, help="robotic steps per fake task")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake API seconds to first byte")
+    parser.add_argument("--chunk-size", type=int, default=40, help="characters per streamed chunk")
+    parser.add_argument("--chunk-delay", type=float, default=0.005, help="seconds between streamed chunks")
+    parser.add_argument("--strategy", default="standard", help="planning strategy (see PLANNING_STRATEGIES)")
+    parser.add_argument("--granularity", type=int, default=2, choices=(1, 2, 3))
+    parser.add_argument("--no-stream", action="store_true", help="turn off streamed task previews")
+    parser.add_argument("--semantic", action="store_true",
+                        help="keep the near-duplicate cache on (cold runs then mostly hit it, since inputs differ only by a prefix)")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds per AppTest run")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(latency=args.latency, chunk_size=args.chunk_size, chunk_delay=args.chunk_delay,
+                              tasks=args.tasks, steps=args.steps).start()
+    # Keep the benchmark's caches and metrics out of the app's own .cache directory
+    workdir = tempfile.mkdtemp(prefix="unstuck-bench-")
+    os.environ.update({
+        "OPENAI_BASE_URL": server.base_url,
+        "RESPONSE_CACHE_PATH": os.path.join(workdir, "responses.sqlite3"),
+        "PROGRESS_STORE_PATH": os.path.join(workdir, "progress.sqlite3"),
+        "METRICS_PATH": os.path.join(workdir, "metrics.prom"),
+        "SEMANTIC_AUDIT_PATH": os.path.join(workdir, "semantic_audit.jsonl"),
+    })
+    if not args.semantic:
+        os.environ["SEMANTIC_CACHE_THRESHOLD"] = "2"  # Cosine similarity never reaches it
+
+    rows = []
+    try:
+        rows += bench_submit(args, server, "none", "valid JSON")
+        rows += bench_submit(args, server, "malformed", "malformed JSON")
+        rows += bench_submit(args, server, "truncated", "truncated JSON")
+        rows += bench_rerun(args, server)
+        rows += bench_memory(args, server)
+        rows += check_near_duplicates()
+    finally:
+        server.stop()
+    print_rows(rows)
+    print(f"fake API requests: {server.requests}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
+    wrong = [row["benchmark"] for row in rows if "expected" in row and row["reused"] != row["expected"]]
+    for name in wrong:
+        print(f"FAILED: {name}", file=sys.stderr)
+    return 1 if wrong else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2463 @@
+# unstuck_core.py
+"""Everything app.py needs besides the page layout: prompts, LLM calls, caches and task rendering.
+
+Streamlit re-executes app.py on every rerun, but an imported module runs only once
+per process, so constants, classes and shared resources here are built once.
+"""
+import time
+_import_start = time.perf_counter()
+import streamlit as st
+import os
+import json
+from dotenv import load_dotenv
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+import importlib.util
+import datetime
+import html
+import itertools
+from collections import deque
+import random
+import re
+import threading
+import hashlib
+import uuid
+from array import array
+import sqlite3
+import tempfile
+import zlib
+import numpy as np
+import textwrap
+from types import MappingProxyType
+from typing import Any, Dict, Literal, NamedTuple, Optional
+from pydantic import BaseModel, ValidationError
+from concurrent.futures import Future, ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Load environment variables from .env
+load_dotenv()
+
+OPENAI_MODEL = "gpt-4o-mini"
+
+# Which model serves each kind of request; breakdowns route by granularity level.
+# Override entries with a JSON object in the MODEL_ROUTING environment variable.
+MODEL_ROUTING = {
+    "emotion": OPENAI_MODEL,
+    "validation": OPENAI_MODEL,
+    "extract": OPENAI_MODEL,
+    "breakdown_1": OPENAI_MODEL,
+    "breakdown_2": OPENAI_MODEL,
+    "breakdown_3": OPENAI_MODEL,
+}
+MODEL_ROUTING.update(json.loads(os.getenv("MODEL_ROUTING", "{}")))
+
+# Output token budgets: breakdowns are sized from granularity and task count
+VALIDATION_MAX_TOKENS = 120  # 2-3 sentences, under 50 words
+STEPS_PER_TASK = {1: 4, 2: 8, 3: 15}  # upper end of each level's step range
+TOKENS_PER_STEP = 28
+TOKENS_PER_TASK_OVERHEAD = 200  # headers, creative options and activation hack
+OUTPUT_BUDGET_MARGIN = 1.25
+MIN_OUTPUT_TOKENS = 400  # for breakdowns whose task count is known (one fan-out task)
+GUESSED_MIN_OUTPUT_TOKENS = 2000  # when the task count is only guessed from the text, which undercounts prose
+MAX_OUTPUT_TOKENS = 8000
+MAX_ESTIMATED_TASKS = 15
+
+# Per-session log ring buffer; levels not listed rank as INFO
+LOG_CAPACITY = 500
+LOG_DISPLAY_LIMIT = 200
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+LOG_MIN_LEVEL = os.getenv("LOG_MIN_LEVEL", "INFO").upper()
+
+# Bump whenever the prompts change so cached responses from old prompts are not reused
+PROMPT_VERSION = "3"
+
+# Persistent response cache settings
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "responses.sqlite3"))
+RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+RESPONSE_CACHE_MAX_ENTRIES = 2000
+
+# Near-duplicate cache: inputs at least this similar (cosine) to one from the same session
+# reuse its stored breakdown; the audit log is rotated once it reaches SEMANTIC_AUDIT_MAX_BYTES
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_MAX_ENTRIES = 2000
+SEMANTIC_DIMENSIONS = 2048
+SEMANTIC_AUDIT_PATH = os.getenv("SEMANTIC_AUDIT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "semantic_audit.jsonl"))
+SEMANTIC_AUDIT_MAX_BYTES = 5 * 1024 * 1024
+
+# Saved plans and checkbox progress, so they survive reloads and restarts
+PROGRESS_STORE_PATH = os.getenv("PROGRESS_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "progress.sqlite3"))
+PROGRESS_FLUSH_DELAY_SECONDS = 1.0
+
+# Local emotion classifier: below this confidence we ask the LLM instead, and a
+# small sample of confident answers is still checked against the LLM label
+EMOTION_CONFIDENCE_THRESHOLD = 0.75
+EMOTION_AUDIT_RATE = float(os.getenv("EMOTION_AUDIT_RATE", "0.05"))
+
+# Output budget for finishing a response that was cut off at max_tokens, and how many
+# times to ask before keeping only its complete tasks
+CONTINUATION_MAX_TOKENS = 1000
+MAX_CONTINUATIONS = 3
+
+# Concurrent per-segment requests when only re-planning changed lines
+INCREMENTAL_MAX_WORKERS = 4
+# How a part of a dump is put to the model, with the whole dump as context
+PART_PROMPT = """Only break down the tasks in this part of the brain dump: "{part}"
+If it doesn't name a task (just a feeling or a comment), respond with an empty JSON object {{}}.
+(Context, the full brain dump: {context})"""
+
+# Concurrent per-task requests when fanning out large brain dumps
+FAN_OUT_MAX_CONCURRENCY = int(os.getenv("FAN_OUT_MAX_CONCURRENCY", "6"))
+
+# Every breakdown asks for both modes
+TASK_MODES = ["🤖 Robotic: Hyper-specific, minimal decision making, lowest activation energy", "🎨 Creative: Multiple approaches with visual aids and technology options"]
+
+# Ways of planning a submission, as offered in the sidebar
+PLANNING_STRATEGIES = {
+    "standard": "One request",
+    "single_shot": "One combined request (check-in + tasks)",
+    "incremental": "Only re-plan changed lines",
+    "fan_out": "One request per task (large dumps)",
+}
+
+# Background generation jobs: shared worker pool size, how often the page checks on a
+# running job, and how long finished jobs are kept for a page to pick up
+JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", "32"))
+JOB_POLL_INTERVAL_SECONDS = 0.5
+JOB_RETENTION_SECONDS = 15 * 60
+
+# Task view: open tasks shown per page ("load more" shows the next page)
+TASKS_PAGE_SIZE = 10
+
+# Server-wide admission control for LLM calls (set to your provider limits)
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+
+# Shared OpenAI connection pool settings (overridable from the environment)
+OPENAI_POOL_MAX_CONNECTIONS = int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", "20"))
+OPENAI_POOL_MAX_KEEPALIVE = int(os.getenv("OPENAI_POOL_MAX_KEEPALIVE", "10"))
+OPENAI_POOL_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_POOL_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 needs the optional h2 package
+OPENAI_HTTP2 = importlib.util.find_spec("h2") is not None
+
+# Metrics: latency samples kept per stage for percentiles, and the Prometheus text file
+METRICS_WINDOW = 1000
+METRICS_QUANTILES = (0.5, 0.95, 0.99)
+METRICS_PATH = os.getenv("METRICS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "metrics.prom"))
+
+# Custom CSS for ADHD-friendly design
+APP_CSS = """
+<style>
+    /* Base styles */
+    .stTextArea textarea {font-size: 18px !important;}
+    button {background: #4CAF50 !important; color: white !important;}
+    
+    /* Task styling */
+    .task-header {
+        font-size: 1.4rem;
+        font-weight: bold;
+        margin: 20px 0 15px 0;
+        padding: 10px;
+        border-bottom: 1px solid #eee;
+    }
+    
+    /* Mode headers */
+    .mode-header {
+        font-size: 1.0rem;
+        font-weight: 600;
+        margin: 15px 0 10px 0;
+        color: #333;
+    }
+    
+    /* Robotic mode items */
+    .robotic-step {
+        margin: 10px 0;
+        padding-left: 20px;
+    }
+    
+    /* Creative mode items */
+    .creative-step {
+        margin: 10px 0;
+        padding-left: 20px;
+    }
+    
+    /* Activation hack */
+    .activation-hack {
+        margin: 15px 0;
+        padding: 10px;
+        background-color: #f9f9f9;
+        border-left: 3px solid #ffc107;
+        font-style: italic;
+    }
+    
+    /* Emphasis for key actions */
+    .key-action {
+        font-weight: bold;
+        color: #0066cc;
+    }
+    
+    /* Arrow styling */
+    .arrow {
+        color: #888;
+        margin: 0 5px;
+    }
+    
+    /* Checkbox styling */
+    .stCheckbox {
+        padding-left: 10px;
+    }
+    
+    /* Task divider */
+    .task-divider {
+        margin: 30px 0;
+        border-top: 1px solid #eee;
+    }
+    
+    /* Log container */
+    .log-container {
+        background: #f0f0f0; 
+        padding: 10px; 
+        border-radius: 5px; 
+        max-height: 300px; 
+        overflow-y: auto; 
+        font-family: monospace;
+    }
+    
+    /* Debug sections */
+    .prompt-display, .response-display {
+        padding: 10px;
+        border-radius: 5px;
+        margin: 10px 0;
+        font-family: monospace;
+        font-size: 0.9rem;
+    }
+    .prompt-display {
+        background: #e6f7ff;
+        border-left: 4px solid #1890ff;
+    }
+    .response-display {
+        background: #f6ffed;
+        border-left: 4px solid #52c41a;
+    }
+    
+    /* Target additional Streamlit expander classes */
+    div[data-testid="stExpander"] {
+        border-left: 5px solid #4CAF50 !important;
+        background-color: #f8f9fa !important;
+        border-radius: 8px !important;
+    }
+
+
+    /* Target only the expander header text */
+    .st-emotion-cache-1h9usn1 p {
+        font-size: 18px !important;
+        background-color: #e6f3ff !important;  /* Light blue background */
+        padding: 4px 8px !important;
+        border-radius: 4px !important;
+        display: inline-block !important;
+    }
+    
+    /* Task header buttons (they open and close a task) */
+    [class*="st-key-task_header_"] button {
+        background: #e6f3ff !important;  /* Light blue background */
+        color: #333 !important;
+        justify-content: flex-start !important;
+        text-align: left !important;
+    }
+    [class*="st-key-task_header_"] button p {
+        font-size: 18px !important;
+    }
+    
+    /* Ensure checkbox labels remain unaffected */
+    .stCheckbox label p {
+        background-color: transparent !important;
+        padding: 0 !important;
+    }
+</style>
+"""
+
+def init_session_state():
+    """Create the per-session state the app relies on, on the first run of a session"""
+    # Initialize session state for logs if it doesn't exist (a fixed-size ring buffer)
+    if 'logs' not in st.session_state:
+        st.session_state.logs = deque(maxlen=LOG_CAPACITY)
+
+    # Initialize session state for task states and expanded sections
+    if 'task_progress' not in st.session_state:
+        st.session_state.task_progress = None
+
+    if 'expanded_tasks' not in st.session_state:
+        st.session_state.expanded_tasks = {}
+
+    # Add a session state to store the last successful response
+    if 'last_tasks' not in st.session_state:
+        st.session_state.last_tasks = None
+    
+    # How many open tasks the task view shows
+    if 'tasks_visible' not in st.session_state:
+        st.session_state.tasks_visible = TASKS_PAGE_SIZE
+    
+    # The background job generating this session's plan, and its validation message
+    if 'active_job' not in st.session_state:
+        st.session_state.active_job = None
+    
+    if 'last_validation' not in st.session_state:
+        st.session_state.last_validation = None
+
+class LogRecord(NamedTuple):
+    """A structured log entry; the message is only formatted when displayed"""
+    created: float
+    level: str
+    message: str
+    args: tuple
+
+    def format(self):
+        timestamp = datetime.datetime.fromtimestamp(self.created).strftime("%H:%M:%S.%f")[:-3]
+        message = self.message % self.args if self.args else self.message
+        return f"[{timestamp}] [{self.level}] {message}"
+
+    def __str__(self):
+        return self.format()
+
+def log_entry(message, level="INFO", args=()):
+    """Add a timestamped log entry to the session state and console.
+
+    Pass %-style args instead of an f-string for large values; they're only
+    formatted if the entry is displayed. Entries below LOG_MIN_LEVEL are dropped.
+    """
+    if LOG_LEVELS.get(level, LOG_LEVELS["INFO"]) < LOG_LEVELS[LOG_MIN_LEVEL]:
+        return None
+    record = LogRecord(time.time(), level, message, args)
+    st.session_state.logs.append(record)
+    return record
+
+def display_logs(limit=LOG_DISPLAY_LIMIT):
+    """Display the most recent logs in the session state"""
+    if st.session_state.logs:
+        tail = list(itertools.islice(reversed(st.session_state.logs), limit))[::-1]
+        log_html = "".join(f"<div class='log-entry'>{html.escape(record.format())}</div><br>" for record in tail)
+        st.markdown(f"<div class='log-container'>{log_html}</div>", unsafe_allow_html=True)
+
+TIPS = (
+    "⚡ Starting is the hardest part - aim for just 2 minutes",
+    "🧩 Break big tasks into tiny, ridiculously small steps (from 'How to ADHD' by Jessica McCabe)",
+    "🔄 Body doubling: work alongside someone (even virtually)",
+    "⏰ Time block with timers - work in short bursts",
+    "🎯 The 1-3-5 rule: 1 big task, 3 medium tasks, 5 small tasks",
+    "🧠 External brain: write EVERYTHING down (from 'Driven to Distraction' by Dr. Hallowell)",
+    "🎮 Gamify your tasks - add points, rewards or challenges (from Jane McGonigal's research)",
+    "👁️ Make it visible - sticky notes, visual reminders",
+    "🌈 Create a dopamine menu - list quick activities that make you happy",
+    "🚀 Two-Minute Rule – If it takes less than 2 minutes, do it immediately (from 'Getting Things Done' by David Allen)",
+    "📌 Anchor Task – Start your day with one small, grounding task to build momentum",
+    "🎧 Soundtrack Your Focus – Use instrumental music or white noise to minimize distractions",
+    "🏷️ Label Your Time – Give each block of time a fun or silly name to make it more engaging",
+    "🤹 Task Batching – Group similar small tasks together to reduce switching costs",
+    "📱 App Jail – Use focus apps to block distracting sites during work sprints",
+    "🧳 The Suitcase Method – Visualize packing tasks into 'suitcases' (time blocks) to make them feel more manageable",
+    "🛑 Set a 'Worry Time' – Schedule specific time to worry about things (from CBT techniques)",
+    "🔄 The 5-4-3-2-1 Trick – Count down from 5 and then just start (from Mel Robbins' '5 Second Rule')",
+    "🏆 Completion Celebrations – Reward yourself immediately after finishing a task (from BJ Fogg's Tiny Habits)",
+    "💡 Use the 'Forest' app to stay focused while working and grow a virtual tree",
+    "🎯 Use the 'Pomodoro Technique' to break work into 25-minute sprints (by Francesco Cirillo)",
+)
+
+def display_random_tip():
+    """Display a random ADHD productivity tip"""
+    return random.choice(TIPS)
+
+AFFIRMATIONS = (
+    "Your brain isn't broken—it's just wired for a world that doesn't exist yet.",
+    "That pile of unfinished projects? They're evidence of your boundless curiosity, not your failure.",
+    "You notice what others miss, feel what others dismiss, and see connections invisible to many.",
+    "The chaos you navigate daily would overwhelm those who judge you most harshly.",
+    "Your \"too much\" energy is exactly what this world needs—never apologize for your spark.",
+    "The path is harder for you, but the view is more beautiful through your eyes.",
+    "For every task you forgot, remember how many brilliant thoughts have crossed your mind.",
+    "Your struggle to fit into neurotypical spaces isn't weakness—it's like trying to run underwater.",
+    "You're not alone—millions navigate this same invisible current against them every day.",
+    "When executive function fails, remember: worth isn't measured by productivity.",
+    "Your hyperfocus isn't a flaw—it's your superpower in disguise.",
+    "The same brain that loses keys can solve problems others can't even see.",
+    "Self-compassion isn't just nice—for you, it's necessary fuel for the journey.",
+    "Behind every \"I can't believe I did that again\" is an \"I'm still here, still trying.\"",
+    "Your resilience in a world not built for you is nothing short of remarkable.",
+    "Time blindness means you live more fully in each moment—a gift and challenge both.",
+    "You've developed strength through constant adaptation that most will never understand.",
+    "Remember: medication, strategies, and support aren't crutches—they're glasses for your mind.",
+    "Your different perspective isn't just valid—it's vital to human progress.",
+    "You belong here, exactly as you are—wild, wonderful brain and all.",
+    "Hey you, with the 37 browser tabs open and that sinking feeling you're forgetting something important—I see you.",
+    "Remember how you rehearsed that 'quick phone call' for an hour, then forgot what you wanted to say anyway? Same.",
+    "That shame spiral when someone says 'just make a schedule' like you haven't tried a hundred times? I know it well.",
+    "The panic of realizing you've been scrolling for two hours when you sat down to 'quickly check something'—you're not alone in this.",
+    "That pile of half-finished projects isn't evidence of failure—it's the battlefield where you fight your brain chemistry daily.",
+    "I know how it feels when people mistake your time blindness for not caring, when actually you care too much.",
+    "You're not crazy for needing noise to focus sometimes and silence other times. Your brain just has its own operating system.",
+    "The exhaustion after a day of 'normal' interactions? That's real. Masking drains us in ways others can't see.",
+    "Those moments when your thoughts race so fast you can't catch them all—I drop those balls too.",
+    "I understand the grief of thinking 'what could I have accomplished if my brain worked differently?'",
+    "When you apologize for being 'too much'—stop. The world needs your intensity and the connections only you can make.",
+    "Those random bursts of motivation aren't character flaws—they're how our engines run. Use them when they come.",
+    "Your messy desk, forgotten appointments, and impulsive decisions don't define your worth or intelligence.",
+    "Remember how you solved that problem everyone else was stuck on? That's your divergent thinking at work.",
+    "When you're beating yourself up for procrastinating again—pause. Our brains require different conditions to launch.",
+    "The medicine, sticky notes, and phone alarms aren't signs of weakness—they're tools, like glasses for someone with blurry vision.",
+    "You've survived every overwhelming day so far, creating workarounds the neurotypical world will never appreciate enough.",
+    "On days when executive function is offline, remember: existing is enough. The dishes can wait.",
+    "This lonely road feels less lonely when we walk it together, sharing our maps and shortcuts.",
+    "Your beautifully chaotic, creative, struggling, resilient ADHD brain belongs in this world. And you're doing better than you think.",
+)
+
+def display_adhd_affirmation():
+    """Display a random affirmation message for ADHD individuals"""
+    return random.choice(AFFIRMATIONS)
+
+class ConnectionStats:
+    """Counts requests vs. new TCP connections/TLS handshakes on the shared OpenAI client.
+
+    The counts also go to the shared metrics (openai_requests, new_connections,
+    tls_handshakes), so the sidebar panel and the Prometheus file show whether
+    connections are being reused.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connects = 0
+        self.tls_handshakes = 0
+
+    def on_request(self, request):
+        """httpx request hook: count the request and trace connection setup for it"""
+        with self.lock:
+            self.requests += 1
+        self.metrics.increment("openai_requests")
+        request.extensions["trace"] = self.trace
+
+    def trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            with self.lock:
+                self.connects += 1
+            self.metrics.increment("new_connections")
+        elif event_name == "connection.start_tls.complete":
+            with self.lock:
+                self.tls_handshakes += 1
+            self.metrics.increment("tls_handshakes")
+
+    def summary(self):
+        with self.lock:
+            reused = self.requests - self.connects
+            return (f"requests={self.requests}, new connections={self.connects}, "
+                    f"TLS handshakes={self.tls_handshakes}, reused={max(reused, 0)}")
+
+@st.cache_resource(show_spinner=False)
+def get_connection_stats():
+    """Process-wide connection reuse counters"""
+    return ConnectionStats(get_metrics())
+
+class Metrics:
+    """Process-wide latency histograms per pipeline stage plus counters (tokens, cache hits, retries).
+
+    Each stage keeps its last METRICS_WINDOW samples for percentiles and an
+    all-time count and sum, like a Prometheus summary.
+    """
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.lock = threading.Lock()
+        self.window = window
+        self.samples = {}   # stage -> deque of recent durations in seconds
+        self.totals = {}    # stage -> [count, sum]
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+            totals = self.totals.setdefault(stage, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def timed(self, stage, fn, *args):
+        """Call fn(*args), recording how long it took under stage (even if it raises)"""
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Per-stage {count, sum, quantiles} and a copy of the counters"""
+        with self.lock:
+            samples = {stage: sorted(values) for stage, values in self.samples.items()}
+            totals = {stage: tuple(values) for stage, values in self.totals.items()}
+            counters = dict(self.counters)
+        stages = {}
+        for stage, values in samples.items():
+            # Nearest-rank percentiles over the recent window
+            quantiles = {q: values[min(len(values) - 1, max(0, int(q * len(values) + 0.5) - 1))]
+                         for q in METRICS_QUANTILES}
+            stages[stage] = {"count": totals[stage][0], "sum": totals[stage][1], "quantiles": quantiles}
+        return stages, counters
+
+    def to_prometheus(self):
+        """Render the metrics in the Prometheus text exposition format"""
+        stages, counters = self.snapshot()
+        lines = ["# HELP unstuck_stage_seconds Wall-clock seconds per pipeline stage",
+                 "# TYPE unstuck_stage_seconds summary"]
+        for stage, summary in sorted(stages.items()):
+            for q, value in summary["quantiles"].items():
+                lines.append(f'unstuck_stage_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'unstuck_stage_seconds_sum{{stage="{stage}"}} {summary["sum"]:.6f}')
+            lines.append(f'unstuck_stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE unstuck_{name}_total counter")
+            lines.append(f"unstuck_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path=METRICS_PATH):
+        """Atomically write the Prometheus text file (for node_exporter's textfile collector).
+
+        Every call writes its own temp file, since sessions finish concurrently, and a
+        failed export is only logged: it must never fail a submission.
+        """
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log_entry(f"Couldn't write metrics file: {e}", "WARNING")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+@st.cache_resource(show_spinner=False)
+def get_metrics():
+    """Process-wide metrics shared by every session"""
+    return Metrics()
+
+def timed_stage(stage, fn, *args):
+    """Stage timer that only feeds the metrics histograms"""
+    return get_metrics().timed(stage, fn, *args)
+
+@st.cache_resource(show_spinner=False)
+def get_openai_client():
+    """Process-wide OpenAI client whose connection pool is shared by every session"""
+    # openai is slow to import, so page views that never submit don't pay for it
+    import_start = time.perf_counter()
+    import httpx
+    from openai import OpenAI, DefaultHttpxClient
+    STARTUP_TIMINGS["openai_import"] = time.perf_counter() - import_start
+    http_client = DefaultHttpxClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=OPENAI_POOL_KEEPALIVE_EXPIRY,
+        ),
+        http2=OPENAI_HTTP2,
+        event_hooks={"request": [get_connection_stats().on_request]},
+    )
+    # Retries are handled by create_chat_completion so they go through admission control
+    # (the key comes from the environment/.env for headless runs, else from Streamlit secrets)
+    api_key = os.getenv("OPENAI_API_KEY") or st.secrets["OPENAI_API_KEY"]
+    return OpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 units per second, up to per_minute"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount):
+        """Seconds until amount units are available (0 if they are now)"""
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        return 0.0 if self.available >= amount else (amount - self.available) / self.rate
+
+    def take(self, amount):
+        self.available -= min(amount, self.capacity)
+
+class LLMScheduler:
+    """Process-wide admission control for LLM calls.
+
+    Requests wait until both the requests-per-minute and tokens-per-minute buckets
+    allow them. Waiting sessions are served round-robin, one request at a time, so
+    one session's burst can't starve everyone else.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.cond = threading.Condition()
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.queues = {}        # session id -> deque of waiting tickets
+        self.rotation = deque()  # session ids with waiting tickets, next to be served first
+
+    def acquire(self, session_id, tokens):
+        """Block until this session may send a request costing about `tokens` tokens"""
+        ticket = object()
+        with self.cond:
+            self.queues.setdefault(session_id, deque()).append(ticket)
+            if session_id not in self.rotation:
+                self.rotation.append(session_id)
+            while True:
+                if self.rotation[0] == session_id and self.queues[session_id][0] is ticket:
+                    wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                    if wait == 0:
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        self.queues[session_id].popleft()
+                        self.rotation.popleft()
+                        if self.queues[session_id]:
+                            self.rotation.append(session_id)
+                        else:
+                            del self.queues[session_id]
+                        self.cond.notify_all()
+                        return
+                    self.cond.wait(wait)
+                else:
+                    self.cond.wait(0.5)
+
+    def queue_position(self, session_id):
+        """1-based place of the session in line, or 0 if it has nothing waiting"""
+        with self.cond:
+            try:
+                return list(self.rotation).index(session_id) + 1
+            except ValueError:
+                return 0
+
+@st.cache_resource(show_spinner=False)
+def get_llm_scheduler():
+    """Process-wide LLM scheduler shared by every session"""
+    return LLMScheduler(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "anonymous"
+
+def log_retry(retry_state):
+    get_metrics().increment("llm_retries")
+    log_entry(f"LLM call failed ({retry_state.outcome.exception()}), retry {retry_state.attempt_number} "
+              f"in {retry_state.next_action.sleep:.1f}s", "WARNING")
+
+def is_retryable(exception):
+    """Rate limits, timeouts, connection errors and 5xx responses are worth retrying"""
+    import openai  # Already loaded by get_openai_client
+    return isinstance(exception, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError))
+
+@retry(
+    retry=retry_if_exception(is_retryable),
+    wait=wait_random_exponential(multiplier=0.5, max=20),
+    stop=stop_after_attempt(LLM_MAX_ATTEMPTS),
+    before_sleep=log_retry,
+    reraise=True,
+)
+def create_chat_completion(client, **request):
+    """client.chat.completions.create behind admission control, retried with jittered backoff"""
+    metrics = get_metrics()
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in request["messages"])
+    metrics.timed("admission_wait", get_llm_scheduler().acquire, current_session_id(), prompt_tokens + request.get("max_tokens", 0))
+    metrics.increment("llm_requests")
+    # For streamed requests this is the time to the first response bytes
+    return metrics.timed("llm_request", lambda: client.chat.completions.create(**request))
+
+class SingleFlight:
+    """Coalesces identical in-flight requests: the first caller runs, the rest share its result"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.coalesced = 0
+
+    def do(self, key, fn, *args):
+        """Run fn(*args) unless an identical call is already running; returns (result, joined)"""
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+                get_metrics().increment("coalesced_requests")
+        if not leader:
+            return future.result(), True
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+        return future.result(), False
+
+@st.cache_resource(show_spinner=False)
+def get_single_flight():
+    """Process-wide request coalescing shared by every session"""
+    return SingleFlight()
+
+def cached_or_generated(cache, key, fn, *args):
+    """Cache lookup for the single-flight leader, in case an identical request finished meanwhile"""
+    if cache.contains(key):
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return fn(*args)
+
+class ResponseCache:
+    """SQLite-backed response cache with TTL expiry and LRU eviction, shared across sessions"""
+
+    def __init__(self, path, ttl_seconds, max_entries):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.conn.commit()
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired"""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.conn.commit()
+                self.misses += 1
+                get_metrics().increment("response_cache_misses")
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            get_metrics().increment("response_cache_hits")
+            return row[0]
+
+    def contains(self, key):
+        """Whether an unexpired entry exists, without touching counters or recency"""
+        with self.lock:
+            row = self.conn.execute("SELECT created FROM responses WHERE key = ?", (key,)).fetchone()
+        return row is not None and time.time() - row[0] <= self.ttl_seconds
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entries over capacity"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.conn.commit()
+
+    def stats(self):
+        return f"hits={self.hits}, misses={self.misses}"
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    """Process-wide response cache shared by every session"""
+    return ResponseCache(RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_ENTRIES)
+
+def normalize_input(user_input):
+    """Normalize a brain dump so trivial whitespace/case edits share a cache entry"""
+    return " ".join(user_input.split()).casefold()
+
+def response_cache_key(kind, user_input, mode=None, granularity_level=None):
+    """Content-addressed key for a cached response"""
+    payload = json.dumps([kind, normalize_input(user_input), granularity_level, mode,
+                          sorted(MODEL_ROUTING.items()), PROMPT_VERSION])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# Filler words that shouldn't make two brain dumps look different
+SEMANTIC_STOP_WORDS = frozenset("""
+    a an the and or but to of for on in at with by i im i'm my me need needs must should have has
+    got gotta also then so just really do doing today tomorrow later
+""".split())
+
+def embed_text(text, dimensions=SEMANTIC_DIMENSIONS):
+    """Unit-length bag of hashed words and character trigrams, so word order and small edits barely matter"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in re.findall(r"\w+", normalize_input(text)):
+        if word in SEMANTIC_STOP_WORDS:
+            continue
+        vector[zlib.crc32(word.encode("utf-8")) % dimensions] += 2.0
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            vector[zlib.crc32(padded[i:i + 3].encode("utf-8")) % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class SemanticCache:
+    """In-memory near-duplicate index: embeddings of past inputs and the responses they got.
+
+    Lookups only match entries of the same namespace (see semantic_namespace) whose
+    cosine similarity reaches the threshold. Least recently used entries are evicted
+    once max_entries is reached, entries expire after ttl_seconds, and every hit is
+    appended to a JSONL audit log so match quality can be reviewed; the log is moved
+    to <path>.1 once it reaches audit_max_bytes.
+    """
+
+    def __init__(self, threshold, max_entries, ttl_seconds, audit_path, audit_max_bytes=SEMANTIC_AUDIT_MAX_BYTES, dimensions=SEMANTIC_DIMENSIONS):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.audit_path = audit_path
+        self.audit_max_bytes = audit_max_bytes
+        self.lock = threading.Lock()
+        self.vectors = np.zeros((max_entries, dimensions), dtype=np.float32)
+        self.entries = [None] * max_entries  # (namespace, text, value, created)
+        self.last_used = np.zeros(max_entries)  # 0 marks a free row
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, namespace, text):
+        """Return (value, similarity, matched_text) for the closest match above the threshold, or None"""
+        vector = embed_text(text)
+        now = time.time()
+        with self.lock:
+            candidates = [row for row, entry in enumerate(self.entries)
+                          if entry is not None and entry[0] == namespace and now - entry[3] <= self.ttl_seconds]
+            best = None
+            if candidates:
+                similarities = self.vectors[candidates] @ vector
+                best_pos = int(np.argmax(similarities))
+                if similarities[best_pos] >= self.threshold:
+                    best = candidates[best_pos], float(similarities[best_pos])
+            if best is None:
+                self.misses += 1
+                get_metrics().increment("semantic_cache_misses")
+                return None
+            row, similarity = best
+            self.last_used[row] = now
+            self.hits += 1
+            _, matched_text, value, _ = self.entries[row]
+        get_metrics().increment("semantic_cache_hits")
+        self.audit(namespace, text, matched_text, similarity)
+        return value, similarity, matched_text
+
+    def add(self, namespace, text, value):
+        """Index text's response, replacing an identical input or the least recently used entry"""
+        vector = embed_text(text)
+        if not vector.any():
+            return
+        now = time.time()
+        with self.lock:
+            row = next((row for row, entry in enumerate(self.entries)
+                        if entry is not None and entry[0] == namespace and entry[1] == text), None)
+            if row is None:
+                row = int(np.argmin(self.last_used))
+            self.vectors[row] = vector
+            self.entries[row] = (namespace, text, value, now)
+            self.last_used[row] = now
+
+    def audit(self, namespace, text, matched_text, similarity):
+        record = {"time": datetime.datetime.now().isoformat(timespec="seconds"), "kind": namespace[0],
+                  "similarity": round(similarity, 4), "input": text, "matched": matched_text}
+        try:
+            os.makedirs(os.path.dirname(self.audit_path), exist_ok=True)
+            with self.lock:
+                if os.path.exists(self.audit_path) and os.path.getsize(self.audit_path) >= self.audit_max_bytes:
+                    os.replace(self.audit_path, self.audit_path + ".1")
+                with open(self.audit_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            log_entry(f"Couldn't write semantic cache audit log: {e}", "WARNING")
+
+    def stats(self):
+        return f"hits={self.hits}, misses={self.misses}"
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache():
+    """Process-wide near-duplicate index; its namespaces keep each session's entries to itself"""
+    return SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS, SEMANTIC_AUDIT_PATH)
+
+def semantic_namespace(kind, mode, granularity_level):
+    """Only responses made in the same session, with the same kind, mode, granularity, prompts
+    and models can be reused: near-duplicate reuse is for one person rewording or editing
+    their dump, and must never answer someone with another person's plan"""
+    return (kind, current_session_id(), json.dumps(mode), granularity_level, PROMPT_VERSION,
+            json.dumps(sorted(MODEL_ROUTING.items())))
+
+def index_semantic(user_input, mode, granularity_level, content, whole_input=True):
+    """Remember each task of a breakdown for per-task reuse and, if whole_input, the
+    breakdown itself for near-duplicate inputs"""
+    semantic = get_semantic_cache()
+    if whole_input:
+        semantic.add(semantic_namespace("breakdown", mode, granularity_level), user_input, content)
+    task_map = load_task_map(content) or {}
+    for task_name, modes in task_map.items():
+        semantic.add(semantic_namespace("task", mode, granularity_level), format_task_name(task_name),
+                     json.dumps({task_name: modes}))
+
+def task_phrases(text):
+    """A brain dump's segments, further split on "and"/"then"/"also"/"plus", for comparing task lists"""
+    return [phrase for segment in split_into_segments(text)
+            for phrase in re.split(r"\s+(?:and|then|also|plus)\s+", segment, flags=re.I) if phrase.strip()]
+
+def same_task_list(text, other, threshold):
+    """Whether two brain dumps list the same tasks: each one's phrases pair off 1:1 with
+    phrases of the other at least threshold similar. A whole-dump embedding can't tell
+    a reworded dump from one with a task added or swapped once the dump is long."""
+    phrases, others = task_phrases(text), task_phrases(other)
+    if len(phrases) != len(others):
+        return False
+    if not phrases:
+        return True
+    similarities = np.array([embed_text(phrase) for phrase in phrases]) @ np.array([embed_text(phrase) for phrase in others]).T
+    for _ in phrases:
+        row, col = np.unravel_index(np.argmax(similarities), similarities.shape)
+        if similarities[row, col] < threshold:
+            return False
+        similarities[row, :] = -1
+        similarities[:, col] = -1
+    return True
+
+def reuse_tasks(task_names, mode, granularity_level, on_task=None):
+    """Find tasks already broken down (in any of this session's dumps) at this mode and granularity;
+    returns (task map of the reused ones, names still to plan)"""
+    semantic = get_semantic_cache()
+    reused = {}
+    remaining = []
+    for task_name in task_names:
+        hit = semantic.lookup(semantic_namespace("task", mode, granularity_level), task_name)
+        if hit is None:
+            remaining.append(task_name)
+            continue
+        for name, modes in json.loads(hit[0]).items():
+            log_entry(f"Reusing '{format_task_name(name)}' for '{task_name}' (similarity {hit[1]:.2f})", "CACHE")
+            reused.setdefault(name, modes)
+            if on_task is not None:
+                on_task(name, modes)
+    return reused, remaining
+
+def route_model(purpose):
+    """Model tier for a kind of request, from MODEL_ROUTING"""
+    return MODEL_ROUTING.get(purpose, OPENAI_MODEL)
+
+def estimate_output_tokens(granularity_level, task_count):
+    """Output tokens a breakdown of task_count tasks at this granularity should need"""
+    per_task = STEPS_PER_TASK.get(granularity_level, STEPS_PER_TASK[2]) * TOKENS_PER_STEP + TOKENS_PER_TASK_OVERHEAD
+    budget = int(task_count * per_task * OUTPUT_BUDGET_MARGIN)
+    return max(MIN_OUTPUT_TOKENS, min(MAX_OUTPUT_TOKENS, budget))
+
+def guessed_output_tokens(granularity_level, user_input):
+    """Output budget for a breakdown of a whole brain dump, whose task count can only be guessed"""
+    return max(GUESSED_MIN_OUTPUT_TOKENS, estimate_output_tokens(granularity_level, estimate_task_count(user_input)))
+
+def estimate_task_count(user_input):
+    """Guess how many tasks a brain dump holds from its segments and length"""
+    by_segments = len(split_into_segments(user_input))
+    by_length = len(user_input.split()) // 12
+    return max(1, min(MAX_ESTIMATED_TASKS, max(by_segments, by_length)))
+
+def call_untimed(stage, fn, *args):
+    """Stand-in for a stage timer when timings aren't being collected"""
+    return fn(*args)
+
+# Only words that carry a feeling in to-do lists too: "write down", "get ready", "good meals",
+# "lost keys" and "calm the dog" are tasks, so words like those are left out
+NEGATIVE_WORDS = frozenset("""
+    overwhelmed overwhelming stress stressed stressful anxious anxiety panic panicking worried worry
+    scared afraid sad depressed tired exhausted burnt burnout frustrated frustrating
+    annoyed angry hate drowning hopeless helpless guilty ashamed shame awful
+    terrible horrible struggling struggle procrastinating sian jialat lonely crying ugh argh
+""".split())
+POSITIVE_WORDS = frozenset("""
+    happy excited exciting awesome amazing motivated determined pumped energized energetic
+    productive proud confident hopeful grateful glad enjoying optimistic relaxed wonderful
+    fantastic yay shiok
+""".split())
+NEGATION_WORDS = frozenset("not no never dont don't isn't isnt wasn't wasnt aint ain't".split())
+# Words that mean the writer is talking about themselves, not just listing tasks
+FIRST_PERSON_WORDS = frozenset("i i'm im i've ive i'd me myself".split())
+
+def looks_like_task_list(user_input, words):
+    """Whether an input is just a list of short tasks, with nothing said about how the writer feels"""
+    items = [item for item in re.split(r"[\n,;•]+", user_input) if item.strip()]
+    return (len(items) >= 2 and all(len(item.split()) <= 6 for item in items)
+            and not FIRST_PERSON_WORDS.intersection(words))
+
+def classify_emotion_locally(user_input):
+    """Lexicon-based emotion guess in microseconds; returns (label, confidence between 0 and 1)"""
+    words = re.findall(r"[a-z']+", user_input.lower())
+    positive = negative = 0
+    for i, word in enumerate(words):
+        negated = i > 0 and words[i - 1] in NEGATION_WORDS
+        if word in NEGATIVE_WORDS:
+            positive, negative = (positive + 1, negative) if negated else (positive, negative + 1)
+        elif word in POSITIVE_WORDS:
+            positive, negative = (positive, negative + 1) if negated else (positive + 1, negative)
+    hits = positive + negative
+    if hits == 0:
+        # No feeling words isn't evidence of no feelings ("nothing works, help"): only a
+        # plain list of tasks counts as confidently neutral, anything else goes to the LLM
+        return "neutral", 0.8 if looks_like_task_list(user_input, words) else 0.5
+    # One word alone stays below EMOTION_CONFIDENCE_THRESHOLD; it takes two that agree
+    margin = abs(positive - negative) / hits
+    confidence = margin * min(1.0, 0.5 + 0.15 * hits)
+    if positive == negative:
+        return "negative", confidence  # Mixed feelings get the gentler, validating response
+    return ("positive" if positive > negative else "negative"), confidence
+
+def canonical_emotion(label):
+    """Map a free-text emotion label onto 'neutral', 'positive' or 'negative'"""
+    if "neutral" in label:
+        return "neutral"
+    return "positive" if "positive" in label else "negative"
+
+class EmotionAgreement:
+    """Process-wide agreement counters between the local classifier and the LLM label,
+    also exported as the emotion_local_only, emotion_compared and emotion_agreed metrics"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.local_only = 0
+        self.compared = 0
+        self.agreed = 0
+
+    def record(self, local_label, llm_label=None):
+        with self.lock:
+            if llm_label is None:
+                self.local_only += 1
+            else:
+                self.compared += 1
+                self.agreed += local_label == llm_label
+        if llm_label is None:
+            self.metrics.increment("emotion_local_only")
+        else:
+            self.metrics.increment("emotion_compared")
+            self.metrics.increment("emotion_agreed", int(local_label == llm_label))
+
+    def summary(self):
+        with self.lock:
+            rate = f"{self.agreed / self.compared:.0%}" if self.compared else "n/a"
+            return f"agreement={self.agreed}/{self.compared} ({rate}), answered locally={self.local_only}"
+
+@st.cache_resource(show_spinner=False)
+def get_emotion_agreement():
+    return EmotionAgreement(get_metrics())
+
+def detect_emotion_with_llm(client, user_input):
+    """Ask the model to classify the emotional tone as 'neutral', 'positive' or 'negative'"""
+    emotion_check = create_chat_completion(
+        client,
+        model=route_model("emotion"),
+        messages=[
+            {"role": "system", "content": "You are an emotion detector. Categorize the emotional tone into one of these categories: 'negative' (stressed, sad, overwhelmed, frustrated), 'positive' (happy, excited, determined), or 'neutral' (no clear emotion)."},
+            {"role": "user", "content": f"What type of emotion does this text convey? Is it netural, positive, or negative? Just use the words 'neutral', 'positive', or 'negative' to describe the emotion. '{user_input}'"}
+        ],
+        temperature=0.1,
+        max_tokens=10
+    )
+    return emotion_check.choices[0].message.content.strip().lower()
+
+def detect_emotion(client, user_input):
+    """Classify the emotional tone of the input as 'neutral', 'positive' or 'negative'.
+
+    Uses the local classifier when it is confident and falls back to the LLM otherwise.
+    """
+    agreement = get_emotion_agreement()
+    local_label, confidence = classify_emotion_locally(user_input)
+    if confidence >= EMOTION_CONFIDENCE_THRESHOLD and random.random() >= EMOTION_AUDIT_RATE:
+        agreement.record(local_label)
+        log_entry(f"Local emotion classifier: {local_label} (confidence {confidence:.2f})")
+        return local_label
+    
+    llm_label = canonical_emotion(detect_emotion_with_llm(client, user_input))
+    agreement.record(local_label, llm_label)
+    log_entry(f"Local emotion classifier said {local_label} (confidence {confidence:.2f}), LLM said {llm_label}; {agreement.summary()}")
+    return llm_label
+
+def fetch_validation(client, user_input, emotion_type):
+    """Get a supportive message matching an already detected (non-neutral) emotion"""
+    # Choose appropriate system prompt based on emotion type
+    if "positive" in emotion_type:
+        system_content = """You are an enthusiastic coach who specializes in supporting people with ADHD/autism.
+        Provide a short, encouraging response (2-3 sentences) that:
+        1. Acknowledges their positive energy or determination
+        2. Amplifies their momentum
+        3. Offers specific encouragement to keep going
+        
+        Keep your response energetic, authentic, and under 50 words. Be specific to their situation."""
+    else:  # negative emotions
+        system_content = """You are an empathetic coach who specializes in supporting people with ADHD/autism.
+        Provide a short, validating response (2-3 sentences) that:
+        1. Acknowledges their emotions and struggles
+        2. Normalizes their experiences
+        3. Offers gentle encouragement
+        
+        Keep your response warm, authentic, and under 50 words. Be specific to their situation."""
+    
+    # Get appropriate validation response
+    response = create_chat_completion(
+        client,
+        model=route_model("validation"),
+        messages=[
+            {"role": "system", "content": system_content},
+            {"role": "user", "content": f"Respond to this statement with appropriate support: '{user_input}'"}
+        ],
+        temperature=0.88,
+        max_tokens=VALIDATION_MAX_TOKENS
+    )
+    log_prompt_usage(response.usage, VALIDATION_MAX_TOKENS)
+    return response.choices[0].message.content
+
+def cached_validation(client, user_input, timed=call_untimed):
+    """Detect the emotion and, unless neutral, fetch a validation message, using the response cache"""
+    cache = get_response_cache()
+    key = response_cache_key("validation", user_input)
+    cached = cache.get(key)
+    if cached is not None:
+        result = json.loads(cached)
+        log_entry(f"Response cache hit for validation ({cache.stats()})", "CACHE")
+        log_entry(f"Emotion detected: {result['emotion']}")
+        return result["validation"]
+    log_entry(f"Response cache miss for validation ({cache.stats()})", "CACHE")
+    
+    def generate():
+        # First detect the emotion type
+        emotion_type = timed("emotion", detect_emotion, client, user_input)
+        log_entry(f"Emotion detected: {emotion_type}")
+        
+        # Skip validation only if neutral
+        if "neutral" in emotion_type:
+            log_entry("Neutral emotion detected, skipping validation")
+            validation = None
+        else:
+            validation = timed("validation", fetch_validation, client, user_input, emotion_type)
+        
+        result = json.dumps({"emotion": emotion_type, "validation": validation})
+        cache.set(key, result)
+        return result
+    
+    result, joined = get_single_flight().do(key, cached_or_generated, cache, key, generate)
+    if joined:
+        log_entry("Joined an identical in-flight validation request", "CACHE")
+    return json.loads(result)["validation"]
+
+GRANULARITY_INSTRUCTIONS = {
+    1: """
+    Task Granularity: LEVEL 1 (MINIMAL)
+    - Create 1-4 steps per task
+    - Focus on broad action summaries (e.g., "**Research options** → Compare 3 brands")
+    - Include only essential tools/time estimates
+    - Perfect for quick planning or high executive function days
+    """,
+    2: """
+    Task Granularity: LEVEL 2 (MODERATE)
+    - Create 4-8 steps per task
+    - Each step = 1 concrete action + context
+    - Balance between overview and details
+    - Provide specific actions with some context
+    - Good for most days and situations
+    - Format: "**Action summary**: Specifics → Next step (time)"
+    - Example: "**Compare frames**: Use Warby Parker app → Save 2 favorites (10 mins)"
+    """,
+    3: """
+    Task Granularity: LEVEL 3 (MAXIMUM DETAIL)
+    - Create 8-15 micro-steps per task
+    - Every physical/mental action gets its own step
+    - Eliminate all ambiguity and decision-making
+    - Perfect for days with low executive function or high anxiety
+    - Focus on starting with the tiniest possible step
+    - Format: "**Micro-action**: Exact instructions (where to click/what to say)"
+    - Example: "**Click Chrome**: Open new tab → Type 'Warby Parker' → Press Enter"
+    """,
+}
+
+TASK_BREAKDOWN_RULES = """
+You are a productivity coach specializing in ADHD/autism-friendly task breakdowns. Your output must EXACTLY follow these formatting rules:
+
+1. **BOLD FORMATTING STRATEGY**:
+   - Bold the first 2-3 words of every step (action verbs) e.g. "Spend 2 mins", *"Book 10-min try-on"*, "Dump all ideas"
+   - Bold all tools/digital aids (apps, websites, programs) e.g. "Google", "Warby Parker Virtual Try-On", "ChatGPT"
+   - Bold time/duration mentions (e.g. "2 mins", *"1-hour project"*, "5 mins")
+   - Bold system labels (e.g., "Urgent", "Someday")
+   - Bold activation hacks (phrases that lower resistance) e.g. "Just find 1 frame you hate", "no commitment"
+   - NEVER bold explanatory text, examples in parentheses, or conjunctions
+
+2. Main Task Headers:
+   - CRITICALLY IMPORTANT: First carefully analyze the user's input text to identify ALL potential tasks, even if they are mentioned only briefly or in broken/fragmented English
+   - For unclear or ambiguous text, err on the side of generating more tasks rather than fewer
+   - Create separate tasks for each distinct activity mentioned by the user
+   - Number each task (1., 2., etc.)
+   - Use this exact format: "Task: "[Task name]" ([brief description])"
+   - Example: "Task: "Buy Spectacles (Don't Know What Frames Are Nice)"
+
+3. Task Extraction Guidelines:
+   - Look for action verbs and nouns that suggest activities
+   - Consider "try X" or "use Y" as potential tasks, even if mentioned in passing
+   - If user mentions software, apps, products, or services (like "ChatGPT", "Claude", "Cursor AI"), create a task for using/trying them
+   - For lists or bullet points, create a task for each distinct item
+   - For unclear text, make a reasonable interpretation and create appropriate tasks
+
+4. Robotic Mode Section:
+   - Use header: "Robotic Mode (For [specific purpose]):"
+   - Create the appropriate number of steps based on the granularity level selected
+   - Bold key words
+   - Use large arrows (→⟶➡) between main actions
+   - Include time-based cues like "Tomorrow:"
+   - For complex steps, use indented bullet points with colored circles (🟢, 🟡, 🔴)
+
+5. Creative Mode Section:
+   - Use header: "Creative Mode (Explore Options):" or similar descriptive subtitle
+   - Use bullet points (•) with emoji prefixes
+   - Italicize app names
+   - Use quotes for suggested phrases or searches
+   - Can include any number of options
+   - Suggest what people usually do in this situation
+   - Include a visual aid like a diagram, chart, or table if relevant
+
+6. Activation Hack Section:
+   - Always include this as a separate section at the end of each task
+   - Format: "Activation Hack: "[short, quotation-marked suggestion]"
+   - Keep very brief and low-effort
+
+7. Visual Hierarchy:
+   - Use consistent spacing between sections
+   - Keep lines short (under 70 characters)
+   - Use emojis as visual anchors
+   - Bold critical information
+
+8. Edge Cases:
+   - If user text has typos, unusual spacing, or grammatical errors, still identify the key tasks
+
+Your output will be shown to ADHD users who need clear visual organization and minimal cognitive load.
+"""
+
+# Example response format - exactly matching the expected output
+EXAMPLE_RESPONSE = """
+{
+        "Task: \\"Research glasses frames\\"": {
+        "Robotic Mode (For Decision Paralysis)": [
+            "1. **Browse options**: Google → \\"best frames for oval face\\"",
+            "2. **Save examples**: Screenshot top 3 → Save to \\"Frames\\" folder",
+            "3. **Get opinions**: Text Sarah: \\"Which of these 3?\\" (by Friday)",
+            "4. **Book try-on**: Use *Warby Parker* app → Schedule in-store "
+        ],
+        "Creative Mode (Explore Options)": [
+            "🤖 *AI, suggest frames for [your face shape] + [skin tone]*",
+            "🎨 *Try the 'Opposite Game': Pick 1 style you'd never wear first*",
+            "👯 *Virtual try-on party: Screen share with 2 friends*",
+            "📸 *Take selfies with 3 filters → See which frames work best*",
+            "💡 *Ask Reddit: 'Most comfortable frames for big heads?'*",
+            "🛍️ *Visit a thrift store → Try random vintage frames for fun*"
+        ],
+        "Activation Hack": "\\"Just search for 1 frame you'd NEVER wear\\""
+    },
+        "Task: \\"Organize digital photos \\"": {
+        "Robotic Mode (For Overwhelm)": [
+            "1. **Install tool**: Download *Gemini Photos* → Open app",
+            "2. **First purge**: Run \\"Find duplicates\\" → Delete 100",
+            "3. **Create folders**: \\"2024\\", \\"Family\\", \\"Travel\\"",
+            "4. **Daily habit**: Sort 20 photos/day → Right after breakfast",
+            "5. **Backup**: Setup *Google Photos* auto-upload tonight"
+        ],
+        "Creative Mode (Alternative Approaches)": [
+            "🎵 *Create a 'Photo Sorting' playlist (only listen while organizing)*",
+            "📅 *Turn it into a challenge: '100 photos/day for 10 days'*",
+            "🤖 *Use AI: 'Group photos by decade/color/emotion'*",
+            "👥 *Live-stream sorting (let viewers pick categories)*",
+            "🍿 *Pretend you're a museum archivist (create 'exhibits')*",
+            "💸 *Reward jar: $1 per 100 photos sorted → Buy something nice*"
+        ],
+        "Activation Hack": "\\"Delete just 3 terrible photos - that's enough!\\""
+    },
+        "Task: \\"Learn Cursor AI\\"": {
+        "Robotic Mode (For Beginners)": [
+            "1. **Sign up**: Go to cursor.sh → Click \\"Try Free\\"",
+            "2. **First test**: Install → Open VS Code project",
+            "3. **Try command**: Press Cmd+K → Type \\"explain this function\\"",
+            "4. **Daily goal**: Use for 1 code review/day (start today)",
+            "5. **Join community**: Register for Cursor Discord (Tomorrow AM)",
+            "6. **Watch intro**: \\"Cursor in 5 minutes\\" (official video)",
+            "7. **Bookmark**: Save docs.cursor.sh in \\"Dev Tools\\" folder"
+        ],
+        "Creative Mode (Advanced Exploration)": [
+            "🎮 *Treat it like a game: Unlock 1 new feature/day*",
+            "🤝 *Partner with a 'Cursor Buddy' (compare discoveries weekly)*",
+            "📝 *Start a 'Cursor Experiments' blog (even if private)*",
+            "💡 *Try the 'Stupid Test': Break it in fun ways first*",
+            "🧩 *Combine with ChatGPT: 'Explain Cursor features like I'm 5'*",
+            "🏆 *Create achievement badges (e.g., 'First AI Commit')*"
+        ],
+        "Activation Hack": "\\"Just read the first paragraph of docs - no pressure!\\""
+    },
+        "Task: \\"Plan Mom's birthday\\"": {
+        "Robotic Mode (For Decision Fatigue)": [
+            "1. **Brainstorm**: Jot 3 gift ideas in Notes app",
+            "2. **Check calendar**: Confirm her availability (Today)",
+            "3. **Text sis**: \\"Help choose: [X] or [Y]?\\" (by Wednesday)",
+            "4. **Order gift**: Use *Amazon* → 2-day delivery cutoff",
+            "5. **Make res**: Book *Olive Garden* → 7pm Friday",
+            "6. **Set reminders**: \\"Wrap gift\\", \\"Buy flowers\\" (Thursday)"
+        ],
+        "Creative Mode (Special Touches)": [
+            "📽️ *Make a 'Mom Through the Decades' slideshow (use old photos)*",
+            "✉️ *Secretly gather 1-sentence memories from family/friends*",
+            "🎂 *Recreate her childhood cake (funny attempt counts!)*",
+            "🕺 *Make a playlist of #1 hits from her teen years*",
+            "📖 *Handwrite a letter about your favorite shared memory*",
+            "🌱 *Plant something together (that grows yearly)*"
+        ],
+        "Activation Hack": "\\"Start by texting your sister 'Hey, need bday help'\\""
+    }
+}
+"""
+
+class PromptTemplate(NamedTuple):
+    """An immutable, versioned task breakdown prompt for one granularity level"""
+    version: str
+    system_prompt: str
+    granularity_instructions: str
+    system_tokens: int
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token for English text)"""
+    return (len(text) + 3) // 4
+
+@st.cache_resource(show_spinner=False)
+def get_prompt_registry():
+    """Build every granularity level's prompt once per process.
+
+    The system prompt (rules + few-shot example) is identical for every request so
+    it forms a stable prefix the provider's prompt caching can reuse; everything
+    that varies (granularity, mode, input) goes in the user message after it.
+    """
+    system_prompt = textwrap.dedent(TASK_BREAKDOWN_RULES).strip() + "\n\n" + textwrap.dedent("""
+    Here's an example of what I'm looking for:
+
+    'Break down this task for ADHD users: "Plan healthy meals for the week".
+    Use Robotic Mode (numbered steps) and Creative Mode (bulleted options).
+    Include 1 activation hack with bold label.'
+
+    Please respond with a JSON object in the following format:
+    ```json
+    {example}
+    ```
+
+    Your response should only contain the JSON object, nothing else. The JSON object should include both Robotic Mode and Creative Mode options regardless of which mode was selected.
+    """).strip().format(example=textwrap.dedent(EXAMPLE_RESPONSE).strip())
+    return MappingProxyType({
+        level: PromptTemplate(
+            version=PROMPT_VERSION,
+            system_prompt=system_prompt,
+            granularity_instructions=textwrap.dedent(instructions).strip(),
+            system_tokens=estimate_tokens(system_prompt),
+        )
+        for level, instructions in GRANULARITY_INSTRUCTIONS.items()
+    })
+
+def build_prompts(user_input, mode, granularity_level):
+    """Build the system and user prompts for the task breakdown request"""
+    template = get_prompt_registry()[granularity_level]
+    user_prompt = f"""{template.granularity_instructions}
+
+Mode: {mode}
+Input: {user_input}
+
+Output:"""
+    log_entry(f"Prompt v{template.version} tokens (est.): system={template.system_tokens} (shared prefix), user={estimate_tokens(user_prompt)}", "CONFIG")
+    return template.system_prompt, user_prompt
+
+def log_prompt_usage(usage, budget=None):
+    """Log actual prompt/completion token counts, including how much of the prompt hit the
+    provider cache and, when given, the output budget the completion was estimated at"""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    metrics = get_metrics()
+    metrics.increment("prompt_tokens", usage.prompt_tokens)
+    metrics.increment("cached_prompt_tokens", cached_tokens)
+    metrics.increment("completion_tokens", usage.completion_tokens)
+    budget_note = f" (estimated budget {budget})" if budget else ""
+    log_entry(f"Prompt tokens: {usage.prompt_tokens} ({cached_tokens} cached), completion tokens: {usage.completion_tokens}{budget_note}", "DATA")
+
+class TaskStreamParser:
+    """Incrementally parse a streamed JSON task map, yielding each top-level task once complete.
+
+    task_depth is the object depth of the task map: 1 for a bare map, 2 when it is
+    nested one level down (as in the single-shot response).
+    """
+
+    def __init__(self, task_depth=1):
+        self.task_depth = task_depth
+        self.buffer = ""
+        self.pos = 0            # next character to scan
+        self.depth = 0          # current object/array nesting depth
+        self.in_string = False
+        self.escaped = False
+        self.entry_start = None  # where the current top-level "key": {...} entry begins
+
+    def feed(self, chunk):
+        """Add a chunk of streamed text and return the (task_name, modes) pairs it completed"""
+        self.buffer += chunk
+        completed = []
+        while self.pos < len(self.buffer):
+            char = self.buffer[self.pos]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+                if self.depth == self.task_depth and self.entry_start is None:
+                    self.entry_start = self.pos
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == self.task_depth and self.entry_start is not None:
+                    entry = self.buffer[self.entry_start:self.pos + 1]
+                    self.entry_start = None
+                    try:
+                        completed.extend(json.loads("{" + entry + "}").items())
+                    except json.JSONDecodeError:
+                        pass  # Leave malformed entries to parse_json_response
+            elif char == "," and self.depth == self.task_depth:
+                self.entry_start = None
+            self.pos += 1
+        return completed
+
+def breakdown_temperature(mode):
+    return 0.3 if mode == "🤖 Robotic" else 0.7
+
+def fetch_task_breakdown(client, system_prompt, user_prompt, mode, on_task=None, max_tokens=2000, task_depth=1, model=OPENAI_MODEL):
+    """Send the task breakdown request and return the raw JSON content.
+
+    When on_task is given the response is streamed and on_task(task_name, modes)
+    is called as soon as each task object is complete.
+    """
+    response = create_chat_completion(
+        client,
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        temperature=breakdown_temperature(mode),
+        max_tokens=max_tokens,
+        response_format={"type": "json_object"},  # Request JSON format
+        **({"stream": True, "stream_options": {"include_usage": True}} if on_task is not None else {})
+    )
+    if on_task is None:
+        log_prompt_usage(response.usage, max_tokens)
+        return response.choices[0].message.content
+
+    parser = TaskStreamParser(task_depth)
+    for chunk in response:
+        if chunk.usage is not None:
+            log_prompt_usage(chunk.usage, max_tokens)
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        for task_name, modes in parser.feed(chunk.choices[0].delta.content):
+            on_task(task_name, modes)
+    return parser.buffer
+
+def fix_common_json_mistakes(text):
+    """Fix mistakes models often make in JSON: bad escapes, trailing commas and
+    task keys that lose their closing quote (as in "Task: \\"Name\\": {)"""
+    text = re.sub(r'\\(.)', lambda m: m.group(0) if m.group(1) in '"\\/bfnrtu' else m.group(1), text, flags=re.S)
+    text = re.sub(r'\\"(\s*:\s*[\{\[])', r'\\""\1', text)
+    return re.sub(r",(\s*[}\]])", r"\1", text)
+
+def repair_task_json(text):
+    """Best-effort recovery of a task map from malformed or truncated output; returns a dict or None"""
+    start = text.find("{")
+    if start == -1:
+        return None
+    text = fix_common_json_mistakes(re.sub(r"\s*```\s*$", "", text[start:]))
+    try:
+        tasks = json.loads(text, strict=False)
+        return tasks if isinstance(tasks, dict) else None
+    except json.JSONDecodeError:
+        pass
+    # Salvage every task object that was complete before the output broke off
+    return dict(TaskStreamParser().feed(text)) or None
+
+def load_task_map(text):
+    """Parse a task map strictly, falling back to repair; returns a dict or None"""
+    try:
+        tasks = json.loads(text)
+        if isinstance(tasks, dict):
+            return tasks
+    except json.JSONDecodeError:
+        pass
+    return repair_task_json(text)
+
+def is_truncated(text):
+    """Whether the JSON text stops inside an unfinished object or string"""
+    parser = TaskStreamParser()
+    parser.feed(text)
+    return parser.depth > 0 or parser.in_string
+
+def continue_truncated(client, system_prompt, user_prompt, partial, mode, model=OPENAI_MODEL):
+    """Ask the model to carry on from where a cut-off response stopped, instead of regenerating it,
+    up to MAX_CONTINUATIONS times while the result is still cut off"""
+    for attempt in range(MAX_CONTINUATIONS):
+        response = create_chat_completion(
+            client,
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+                {"role": "assistant", "content": partial},
+                {"role": "user", "content": "Your response was cut off. Continue the JSON exactly where it stopped. Don't repeat anything and don't add any other text."}
+            ],
+            temperature=breakdown_temperature(mode),
+            max_tokens=CONTINUATION_MAX_TOKENS
+        )
+        log_prompt_usage(response.usage, CONTINUATION_MAX_TOKENS)
+        continuation = re.sub(r"^\s*```(?:json)?\s*", "", response.choices[0].message.content or "")
+        partial += continuation
+        if not continuation or not is_truncated(partial):
+            break
+        log_entry(f"Continuation {attempt + 1} was cut off too", "WARNING")
+    return partial
+
+def near_duplicate_breakdown(client, user_input, mode, granularity_level, on_task=None, timed=call_untimed):
+    """Build a task breakdown from earlier ones, or return None if it has to be generated.
+
+    A near-duplicate dump's whole plan is only reused when both list the same tasks
+    (see same_task_list). Otherwise, if some segments of a multi-segment dump match
+    tasks planned before, those tasks are reused and only the other segments are planned.
+    """
+    semantic = get_semantic_cache()
+    hit = semantic.lookup(semantic_namespace("breakdown", mode, granularity_level), user_input)
+    if hit is not None:
+        content, similarity, matched = hit
+        if same_task_list(user_input, matched, semantic.threshold):
+            log_entry(f"Near-duplicate cache hit for task breakdown (similarity {similarity:.2f} to '{matched[:60]}')", "CACHE")
+            if on_task is not None:
+                for task_name, modes in TaskStreamParser().feed(content):
+                    on_task(task_name, modes)
+            return content
+        log_entry(f"Not reusing the plan for '{matched[:60]}' (similarity {similarity:.2f}): it lists different tasks", "CACHE")
+        get_metrics().increment("semantic_cache_rejections")
+    
+    segments = split_into_segments(user_input)
+    if len(segments) < 2:
+        return None
+    reused, remaining = reuse_tasks(segments, mode, granularity_level, on_task)
+    if not reused:
+        return None
+    log_entry(f"Reused {len(reused)} tasks, planning {len(remaining)} of {len(segments)} segments", "CACHE")
+    if not remaining:
+        return json.dumps(reused)
+    return timed("breakdown", plan_concurrently, client, remaining, mode, granularity_level, on_task, INCREMENTAL_MAX_WORKERS, None, False, reused)
+
+def cached_task_breakdown(client, user_input, mode, granularity_level, on_task=None, timed=call_untimed, task_count=None, semantic=True, context=None):
+    """Get the raw task breakdown, serving identical recent requests from the response cache
+    and, when semantic is set, near-duplicate ones from the semantic cache.
+
+    If context (the whole brain dump) is given, user_input is one part of it: the
+    model sees the context (see PART_PROMPT), but the part alone is the cache key,
+    so editing other parts of the dump doesn't invalidate it.
+
+    max_tokens is sized from the granularity and task_count (estimated from the
+    input, with a floor of GUESSED_MIN_OUTPUT_TOKENS, when not known) and the
+    model comes from MODEL_ROUTING.
+    """
+    cache = get_response_cache()
+    key = response_cache_key("breakdown", user_input, mode, granularity_level)
+    content = cache.get(key)
+    if content is not None:
+        log_entry(f"Response cache hit for task breakdown ({cache.stats()})", "CACHE")
+        index_semantic(user_input, mode, granularity_level, content, semantic)
+        if on_task is not None:
+            for task_name, modes in TaskStreamParser().feed(content):
+                on_task(task_name, modes)
+        return content
+    log_entry(f"Response cache miss for task breakdown ({cache.stats()})", "CACHE")
+    if semantic:
+        content = near_duplicate_breakdown(client, user_input, mode, granularity_level, on_task, timed)
+        if content is not None:
+            return content
+    
+    def generate():
+        prompt_input = user_input if context is None else PART_PROMPT.format(part=user_input, context=context)
+        system_prompt, user_prompt = timed("prompt_build", build_prompts, prompt_input, mode, granularity_level)
+        log_entry("Prompts prepared and displayed with JSON example")
+        if task_count is not None:
+            estimated_tasks, max_tokens = task_count, estimate_output_tokens(granularity_level, task_count)
+        else:
+            estimated_tasks, max_tokens = estimate_task_count(user_input), guessed_output_tokens(granularity_level, user_input)
+        model = route_model(f"breakdown_{granularity_level}")
+        log_entry(f"Output budget: {max_tokens} tokens for ~{estimated_tasks} tasks at level {granularity_level}, model {model}", "CONFIG")
+        content = timed("breakdown", fetch_task_breakdown, client, system_prompt, user_prompt, mode, on_task, max_tokens, 1, model)
+        if is_truncated(content):
+            log_entry("Response was cut off, asking the model to continue it", "WARNING")
+            content = timed("continuation", continue_truncated, client, system_prompt, user_prompt, content, mode, model)
+        
+        # Only cache complete responses that parse (or could be repaired), so a malformed
+        # reply can be retried and tasks salvaged from a cut-off one aren't served again
+        complete = not is_truncated(content)
+        try:
+            json.loads(content)
+        except json.JSONDecodeError:
+            tasks = repair_task_json(content)
+            if tasks is None:
+                return content
+            content = json.dumps(tasks)
+            if not complete:
+                log_entry(f"Salvaged {len(tasks)} complete tasks from a cut-off response; not caching it", "WARNING")
+                return content
+            log_entry(f"Repaired malformed response ({len(tasks)} tasks)", "WARNING")
+        cache.set(key, content)
+        index_semantic(user_input, mode, granularity_level, content, semantic)
+        return content
+    
+    content, joined = get_single_flight().do(key, cached_or_generated, cache, key, generate)
+    if joined:
+        log_entry("Joined an identical in-flight task breakdown request", "CACHE")
+        if on_task is not None:
+            for task_name, modes in TaskStreamParser().feed(content):
+                on_task(task_name, modes)
+    return content
+
+class SingleShotResponse(BaseModel):
+    """Schema of the combined emotion + validation + task breakdown response"""
+    emotion: Literal["neutral", "positive", "negative"]
+    validation: Optional[str] = None
+    tasks: Dict[str, Dict[str, Any]]
+
+SINGLE_SHOT_INSTRUCTIONS = """
+Also classify the emotional tone of the input as "negative" (stressed, sad, overwhelmed, frustrated), "positive" (happy, excited, determined) or "neutral" (no clear emotion).
+If it is not neutral, write a short supportive message (2-3 sentences, under 50 words, specific to their situation) as an ADHD/autism coach: for negative, acknowledge and normalize their struggles and offer gentle encouragement; for positive, acknowledge and amplify their momentum.
+
+Respond with one JSON object with exactly these keys, in this order:
+{"emotion": "neutral" | "positive" | "negative", "validation": "<message>" or null, "tasks": {<task map in the example format>}}
+"""
+
+def repair_single_shot(text):
+    """Best-effort recovery of a malformed or truncated single-shot response: its emotion,
+    validation and every complete task; returns a dict or None"""
+    data = repair_task_json(text)
+    if isinstance(data, dict) and isinstance(data.get("tasks"), dict):
+        return data
+    start = text.find("{")
+    if start == -1:
+        return None
+    tasks = dict(TaskStreamParser(task_depth=2).feed(fix_common_json_mistakes(text[start:])))
+    if not tasks:
+        return None
+    emotion = re.search(r'"emotion"\s*:\s*"([^"]*)"', text)
+    validation = re.search(r'"validation"\s*:\s*("(?:[^"\\]|\\.)*")', text)
+    return {"emotion": emotion.group(1) if emotion else "neutral",
+            "validation": json.loads(validation.group(1), strict=False) if validation else None,
+            "tasks": tasks}
+
+def parse_single_shot(content):
+    """Validate a single-shot response, repairing it when needed and normalizing the emotion label"""
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        data = repair_single_shot(content)
+        if data is None:
+            raise ValueError("Single-shot response wasn't valid JSON and couldn't be repaired")
+        log_entry(f"Repaired malformed single-shot response ({len(data['tasks'])} tasks)", "WARNING")
+    if isinstance(data, dict) and isinstance(data.get("emotion"), str):
+        data["emotion"] = canonical_emotion(data["emotion"].strip().casefold())
+    try:
+        return SingleShotResponse.model_validate(data)
+    except ValidationError as e:
+        raise ValueError(f"Single-shot response didn't match the expected format: {e.error_count()} errors") from e
+
+def submit_with_context(executor, fn, *args):
+    """Submit fn to executor, running it with the current script context so log_entry works"""
+    ctx = get_script_run_ctx()
+    
+    def run():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(*args)
+    
+    return executor.submit(run)
+
+# Task-level segments (for estimating and matching tasks) and the coarser lines that
+# incremental planning re-plans, where a comma can sit inside one task ("eggs, milk and bread")
+SEGMENT_SEPARATORS = r"[\n;,]+|\.{2,}|…|\s[•*+&-]\s|\sn\s"
+LINE_SEPARATORS = r"\n+|\s•\s"
+
+def split_into_segments(user_input, separators=SEGMENT_SEPARATORS):
+    """Split a brain dump into task-level segments: lines, bullets, commas, semicolons, ellipses
+    and a spaced "+", "&" or "n" (or only what separators matches, e.g. LINE_SEPARATORS for lines and bullets)"""
+    segments = []
+    seen = set()
+    for part in re.split(separators, user_input):
+        segment = " ".join(part.split()).lstrip("•*- ")
+        fingerprint = normalize_input(segment)
+        if len(fingerprint) > 1 and fingerprint not in seen:
+            seen.add(fingerprint)
+            segments.append(segment)
+    return segments
+
+def pick_task(part_tasks, task_name):
+    """The (name, modes) in a response that best matches the one task it was asked to plan"""
+    target = embed_text(task_name)
+    return max(part_tasks.items(), key=lambda item: float(embed_text(format_task_name(item[0])) @ target))
+
+def plan_concurrently(client, inputs, mode, granularity_level, on_task=None, max_workers=4, task_count=None, semantic=True, merged=None, task_names=None, context=None):
+    """Break down each input as its own (cached) request, concurrently, and merge the task maps
+    (into merged, if given, after the tasks already there). context, if given, is the
+    whole dump the inputs are parts of (see cached_task_breakdown).
+
+    If task_names is given (one per input), each input asks for that one task, and
+    only the task of its response that matches it best is kept and streamed.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(len(inputs), max_workers)), thread_name_prefix="planner") as executor:
+        part_on_task = on_task if task_names is None else None
+        futures = [submit_with_context(executor, cached_task_breakdown, client, part, mode, granularity_level, part_on_task, call_untimed, task_count, semantic, context)
+                   for part in inputs]
+        if task_names is not None and on_task is not None:
+            for future, task_name in zip(futures, task_names):
+                def stream_pick(future, task_name=task_name):
+                    part_tasks = None if future.exception() is not None else load_task_map(future.result())
+                    if part_tasks:
+                        on_task(*pick_task(part_tasks, task_name))
+                future.add_done_callback(stream_pick)
+    
+    # A failed part shouldn't throw away the others
+    merged = dict(merged or {})
+    failures = []
+    for position, (part, future) in enumerate(zip(inputs, futures)):
+        if future.exception() is not None:
+            log_entry(f"Error planning '{part[:60]}': {str(future.exception())}", "ERROR")
+            failures.append(future.exception())
+            continue
+        part_tasks = load_task_map(future.result())
+        if part_tasks is None:
+            log_entry(f"Skipping '{part[:60]}': response wasn't valid JSON", "WARNING")
+            continue
+        if task_names is not None and len(part_tasks) > 1:
+            # The model re-planned the whole dump it was given as context; the other tasks have parts of their own
+            log_entry(f"Keeping 1 of {len(part_tasks)} tasks planned for '{part[:60]}'", "WARNING")
+            part_tasks = dict([pick_task(part_tasks, task_names[position])])
+        for task_name, modes in part_tasks.items():
+            name, suffix = task_name, 2
+            while name in merged:
+                name, suffix = f"{task_name} ({suffix})", suffix + 1
+            merged[name] = modes
+    if failures and len(failures) == len(inputs) and not merged:
+        raise failures[0]
+    return json.dumps(merged)
+
+def cached_incremental_breakdown(client, user_input, mode, granularity_level, on_task=None, timed=call_untimed):
+    """Plan each line (or bullet) of the brain dump separately, with the whole dump as
+    context, and merge the results.
+
+    Every line's breakdown is cached under the line alone, so after an edit only
+    new or changed lines reach the model.
+    """
+    lines = split_into_segments(user_input, LINE_SEPARATORS)
+    if len(lines) < 2:
+        return cached_task_breakdown(client, user_input, mode, granularity_level, on_task, timed)
+    cache = get_response_cache()
+    changed = sum(1 for line in lines
+                  if not cache.contains(response_cache_key("breakdown", line, mode, granularity_level)))
+    log_entry(f"Incremental plan: {len(lines)} lines, {changed} new or changed")
+    return timed("breakdown", plan_concurrently, client, lines, mode, granularity_level, on_task, INCREMENTAL_MAX_WORKERS,
+                 None, True, None, None, user_input)
+
+TASK_EXTRACTION_PROMPT = """You extract tasks from messy ADHD brain dumps.
+Identify ALL distinct tasks or activities the user mentions, even briefly or in broken English; if they mention software, apps or services, include trying/using them.
+Reply with a JSON object: {"tasks": ["<short task name>", ...]}"""
+
+def extract_task_list(client, user_input):
+    """Cheap first pass for fan-out planning: just the list of task names in the brain dump"""
+    cache = get_response_cache()
+    key = response_cache_key("extract", user_input)
+    cached = cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+    response = create_chat_completion(
+        client,
+        model=route_model("extract"),
+        messages=[
+            {"role": "system", "content": TASK_EXTRACTION_PROMPT},
+            {"role": "user", "content": user_input}
+        ],
+        temperature=0.2,
+        max_tokens=400,
+        response_format={"type": "json_object"}
+    )
+    log_prompt_usage(response.usage, 400)
+    tasks = json.loads(response.choices[0].message.content).get("tasks", [])
+    task_names = [str(task).strip() for task in tasks if str(task).strip()]
+    if task_names:
+        cache.set(key, json.dumps(task_names))
+    return task_names
+
+def cached_fan_out_breakdown(client, user_input, mode, granularity_level, on_task=None, timed=call_untimed):
+    """Two-phase planning for large dumps: extract the task list, then break down every task concurrently.
+
+    Wall-clock time follows the slowest single task rather than the whole plan's
+    length, and no single response has to fit every task under max_tokens.
+    """
+    task_names = timed("extract", extract_task_list, client, user_input)
+    if not task_names:
+        log_entry("Task extraction found nothing, falling back to a single request", "WARNING")
+        return cached_task_breakdown(client, user_input, mode, granularity_level, on_task, timed)
+    
+    # Reuse tasks this session already broke down (in this or an earlier dump) at this mode and granularity
+    reused, remaining = reuse_tasks(task_names, mode, granularity_level, on_task)
+    log_entry(f"Fan-out plan: {len(task_names)} tasks ({len(reused)} reused), up to {FAN_OUT_MAX_CONCURRENCY} at a time")
+    if not remaining:
+        return json.dumps(reused)
+    # Each part's prompt carries the whole dump as context, so parts are too alike to match as whole inputs
+    inputs = [f'Only break down this one task: "{task_name}"\n(Context, the full brain dump: {user_input})'
+              for task_name in remaining]
+    return timed("breakdown", plan_concurrently, client, inputs, mode, granularity_level, on_task, FAN_OUT_MAX_CONCURRENCY, 1, False, reused, remaining)
+
+def cached_single_shot(client, user_input, mode, granularity_level, on_task=None, timed=call_untimed):
+    """Get emotion, validation and task breakdown from one request; returns a SingleShotResponse"""
+    cache = get_response_cache()
+    key = response_cache_key("single_shot", user_input, mode, granularity_level)
+    content = cache.get(key)
+    if content is not None:
+        log_entry(f"Response cache hit for single-shot response ({cache.stats()})", "CACHE")
+        result = SingleShotResponse.model_validate_json(content)
+        if on_task is not None:
+            for task_name, modes in result.tasks.items():
+                on_task(task_name, modes)
+        return result
+    log_entry(f"Response cache miss for single-shot response ({cache.stats()})", "CACHE")
+    
+    def generate():
+        system_prompt, user_prompt = timed("prompt_build", build_prompts, user_input, mode, granularity_level)
+        user_prompt = user_prompt.removesuffix("Output:") + textwrap.dedent(SINGLE_SHOT_INSTRUCTIONS).strip() + "\n\nOutput:"
+        max_tokens = guessed_output_tokens(granularity_level, user_input) + VALIDATION_MAX_TOKENS
+        model = route_model(f"breakdown_{granularity_level}")
+        log_entry(f"Output budget: {max_tokens} tokens at level {granularity_level}, model {model}", "CONFIG")
+        content = timed("single_shot", fetch_task_breakdown, client, system_prompt, user_prompt, mode, on_task, max_tokens, 2, model)
+        if is_truncated(content):
+            log_entry("Single-shot response was cut off, asking the model to continue it", "WARNING")
+            content = timed("continuation", continue_truncated, client, system_prompt, user_prompt, content, mode, model)
+        complete = not is_truncated(content)
+        result = parse_single_shot(content)
+        
+        if result.emotion == "neutral":
+            result = result.model_copy(update={"validation": None})
+        content = result.model_dump_json()
+        # As for task breakdowns, tasks salvaged from a cut-off response aren't cached
+        if complete:
+            cache.set(key, content)
+        else:
+            log_entry(f"Salvaged {len(result.tasks)} complete tasks from a cut-off single-shot response; not caching it", "WARNING")
+        return content
+    
+    content, joined = get_single_flight().do(key, cached_or_generated, cache, key, generate)
+    result = SingleShotResponse.model_validate_json(content)
+    log_entry(f"Emotion detected: {result.emotion}")
+    if joined:
+        log_entry("Joined an identical in-flight single-shot request", "CACHE")
+        if on_task is not None:
+            for task_name, modes in result.tasks.items():
+                on_task(task_name, modes)
+    return result
+
+def run_submission_pipeline(user_input, mode, granularity_level, on_task=None, strategy="standard", executor=None):
+    """Run emotion detection, validation and task breakdown concurrently.
+
+    The task breakdown starts at the same time as emotion classification; the
+    validation call only starts once the classifier says the input isn't neutral.
+    strategy is a PLANNING_STRATEGIES key: "single_shot" gets all three from one
+    combined request, "incremental" plans per segment and "fan_out" per task.
+    If on_task is given the breakdown is streamed (see fetch_task_breakdown).
+    Returns (validation_future, breakdown_future, stage_timings); stage_timings is
+    filled in with wall-clock seconds per stage as each one finishes, and every
+    stage is also recorded in the shared metrics. The work runs on executor if
+    given (it must have at least two workers), else on a pool of its own.
+    """
+    own_executor = executor is None
+    stage_timings = {}
+    metrics = get_metrics()
+
+    def timed(stage, fn, *args):
+        start = time.time()
+        try:
+            return fn(*args)
+        finally:
+            stage_timings[stage] = time.time() - start
+            metrics.observe(stage, stage_timings[stage])
+
+    client = get_openai_client()
+    if strategy == "single_shot":
+        log_entry("Sending single-shot request to OpenAI API", "API")
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline")
+        combined_future = submit_with_context(executor, cached_single_shot, client, user_input, mode, granularity_level, on_task, timed)
+        if own_executor:
+            executor.shutdown(wait=False)
+        
+        # Split the combined result so callers handle it exactly like separate requests
+        validation_future, breakdown_future = Future(), Future()
+        def split_result(future):
+            if future.exception() is not None:
+                validation_future.set_exception(future.exception())
+                breakdown_future.set_exception(future.exception())
+            else:
+                validation_future.set_result(future.result().validation)
+                breakdown_future.set_result(json.dumps(future.result().tasks))
+        combined_future.add_done_callback(split_result)
+        return validation_future, breakdown_future, stage_timings
+    
+    log_entry("Sending concurrent requests to OpenAI API", "API")
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pipeline")
+    breakdown = {
+        "incremental": cached_incremental_breakdown,
+        "fan_out": cached_fan_out_breakdown,
+    }.get(strategy, cached_task_breakdown)
+    breakdown_future = submit_with_context(executor, breakdown, client, user_input, mode, granularity_level, on_task, timed)
+    validation_future = submit_with_context(executor, cached_validation, client, user_input, timed)
+    if own_executor:
+        executor.shutdown(wait=False)
+    return validation_future, breakdown_future, stage_timings
+
+class Job:
+    """One submission running in the background; the page polls it by id"""
+
+    def __init__(self, job_id, session_id, key, stream):
+        self.id = job_id
+        self.session_id = session_id
+        self.key = key
+        self.stream = stream
+        self.created = time.time()
+        self.finished = None
+        self.streamed = []  # (task_name, modes) in the order they arrived
+        self.validation_future = None
+        self.breakdown_future = None
+        self.stage_timings = {}
+
+    def on_task(self, task_name, modes):
+        if not self.streamed:
+            log_entry(f"First task streamed after {time.time() - self.created:.2f} seconds", "TIMING")
+        self.streamed.append((task_name, modes))
+
+    def done(self):
+        return self.validation_future.done() and self.breakdown_future.done()
+    
+    def mark_finished(self, _future):
+        if self.done():
+            self.finished = time.time()
+
+class JobManager:
+    """Process-wide background generation: submissions run on a shared worker pool and
+    return a job id at once, so reruns, widget changes and reloads can't cancel paid work.
+
+    Each session's latest job is remembered, an identical resubmission while a job is
+    still running joins it instead of starting another, and finished jobs are kept
+    for JOB_RETENTION_SECONDS for a page to pick up.
+    """
+
+    def __init__(self, max_workers, retention_seconds):
+        self.executor = ThreadPoolExecutor(max_workers=max(2, max_workers), thread_name_prefix="job")
+        self.retention_seconds = retention_seconds
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.latest = {}  # session id -> job id
+
+    def submit(self, session_id, user_input, mode, granularity_level, strategy, stream):
+        """Start generating a plan (or join the identical running one); returns the Job"""
+        key = (normalize_input(user_input), json.dumps(mode), granularity_level, strategy)
+        with self.lock:
+            self.prune()
+            current = self.jobs.get(self.latest.get(session_id))
+            if current is not None and current.key == key and not current.done():
+                log_entry(f"Joined running job {current.id}", "INFO")
+                return current
+        # Outside the lock: the first job creates the OpenAI client, which shouldn't hold up other sessions
+        job = Job(uuid.uuid4().hex, session_id, key, stream)
+        job.validation_future, job.breakdown_future, job.stage_timings = run_submission_pipeline(
+            user_input, mode, granularity_level, job.on_task if stream else None, strategy, self.executor)
+        job.validation_future.add_done_callback(job.mark_finished)
+        job.breakdown_future.add_done_callback(job.mark_finished)
+        with self.lock:
+            self.jobs[job.id] = job
+            self.latest[session_id] = job.id
+        log_entry(f"Started job {job.id}")
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def prune(self):
+        """Forget jobs that finished more than retention_seconds ago (caller holds the lock)"""
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished is not None and job.finished < cutoff]:
+            job = self.jobs.pop(job_id)
+            if self.latest.get(job.session_id) == job_id:
+                del self.latest[job.session_id]
+
+@st.cache_resource(show_spinner=False)
+def get_job_manager():
+    """Process-wide background job manager shared by every session"""
+    return JobManager(JOB_MAX_WORKERS, JOB_RETENTION_SECONDS)
+
+def task_callback(task_key):
+    """Toggle task expanded state"""
+    st.session_state.expanded_tasks[task_key] = not st.session_state.expanded_tasks.get(task_key, False)
+    log_entry(f"Task {task_key} expanded state toggled to {st.session_state.expanded_tasks[task_key]}")
+
+def load_more_tasks():
+    """Show the next page of tasks"""
+    st.session_state.tasks_visible += TASKS_PAGE_SIZE
+    log_entry(f"Showing up to {st.session_state.tasks_visible} tasks")
+
+def checkbox_callback(response_id, task_pos, step_pos):
+    """Toggle checkbox state without causing a full rerun"""
+    progress = st.session_state.task_progress
+    if progress is None or progress.response_id != response_id:
+        return  # Checkbox from a previous response
+    value = progress.toggle(task_pos, step_pos)
+    log_entry(f"Checkbox {task_pos + 1}.{step_pos + 1} toggled to {value}")
+    token = st.query_params.get("plan")
+    if token:
+        get_progress_store().mark_dirty(token, progress)
+    # Force a rerun to update the UI
+    # st.rerun()
+
+
+class TaskStep(NamedTuple):
+    key: str    # checkbox widget / progress key
+    label: str  # display text, numbering already applied
+
+class TaskSection(NamedTuple):
+    header: str
+    steps: tuple
+
+class Task(NamedTuple):
+    """A parsed task, normalized once so reruns do no parsing or regex work"""
+    index: int
+    name: str     # raw name as returned by the model
+    title: str    # cleaned name for display
+    sections: tuple
+    hack: Optional[str]
+    step_keys: tuple
+
+class TaskProgress:
+    """Checkbox progress for one response: a byte per step plus a running completed count per task"""
+    __slots__ = ("response_id", "steps", "completed")
+
+    def __init__(self, response_id, step_counts):
+        self.response_id = response_id
+        self.steps = [array('B', bytes(count)) for count in step_counts]
+        self.completed = array('H', [0] * len(step_counts))
+
+    def toggle(self, task_pos, step_pos):
+        """Flip one step and return its new state"""
+        value = self.steps[task_pos][step_pos] ^ 1
+        self.steps[task_pos][step_pos] = value
+        self.completed[task_pos] += 1 if value else -1
+        return bool(value)
+
+    def is_done(self, task_pos, step_pos):
+        return bool(self.steps[task_pos][step_pos])
+
+    def completed_count(self, task_pos):
+        return self.completed[task_pos]
+
+    def total_count(self, task_pos):
+        return len(self.steps[task_pos])
+
+    def to_bytes(self):
+        return b"".join(steps.tobytes() for steps in self.steps)
+
+    @classmethod
+    def from_bytes(cls, response_id, step_counts, blob):
+        """Rebuild progress saved with to_bytes"""
+        progress = cls(response_id, step_counts)
+        offset = 0
+        for task_pos, count in enumerate(step_counts):
+            progress.steps[task_pos] = array('B', blob[offset:offset + count])
+            progress.completed[task_pos] = sum(progress.steps[task_pos])
+            offset += count
+        return progress
+
+class ProgressStore:
+    """SQLite (WAL) store of saved plans and their checkbox progress, keyed by plan token.
+
+    Checkbox toggles only mark a plan dirty; a timer flushes all dirty plans in one
+    transaction PROGRESS_FLUSH_DELAY_SECONDS after the first toggle.
+    """
+
+    def __init__(self, path, flush_delay):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.flush_delay = flush_delay
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.timer = None
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS plans ("
+            "token TEXT PRIMARY KEY, response_id TEXT NOT NULL, tasks TEXT NOT NULL, "
+            "progress BLOB NOT NULL, updated REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def save_plan(self, token, tasks, progress):
+        """Write a newly generated plan immediately"""
+        with self.lock:
+            self.pending.pop(token, None)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO plans (token, response_id, tasks, progress, updated) VALUES (?, ?, ?, ?, ?)",
+                (token, progress.response_id, json.dumps(tasks), progress.to_bytes(), time.time())
+            )
+            self.conn.commit()
+
+    def mark_dirty(self, token, progress):
+        """Schedule the plan's progress to be written with the next batch"""
+        with self.lock:
+            self.pending[token] = progress
+            if self.timer is None:
+                self.timer = threading.Timer(self.flush_delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """Write all pending progress in a single transaction"""
+        with self.lock:
+            pending, self.pending, self.timer = self.pending, {}, None
+            if not pending:
+                return
+            now = time.time()
+            self.conn.executemany(
+                "UPDATE plans SET progress = ?, updated = ? WHERE token = ? AND response_id = ?",
+                [(progress.to_bytes(), now, token, progress.response_id) for token, progress in pending.items()]
+            )
+            self.conn.commit()
+
+    def load_plan(self, token):
+        """Return (tasks, progress) for a saved plan, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response_id, tasks, progress FROM plans WHERE token = ?", (token,)
+            ).fetchone()
+        if row is None:
+            return None
+        response_id, tasks_json, blob = row
+        tasks = tasks_from_json(json.loads(tasks_json))
+        progress = TaskProgress.from_bytes(response_id, [len(task.step_keys) for task in tasks], blob)
+        return tasks, progress
+
+@st.cache_resource(show_spinner=False)
+def get_progress_store():
+    """Process-wide plan/progress store shared by every session"""
+    return ProgressStore(PROGRESS_STORE_PATH, PROGRESS_FLUSH_DELAY_SECONDS)
+
+def tasks_from_json(data):
+    """Rebuild Task records from their JSON form (NamedTuples serialize as lists)"""
+    return tuple(
+        Task(index, name, title,
+             tuple(TaskSection(header, tuple(TaskStep(*step) for step in steps)) for header, steps in sections),
+             hack, tuple(step_keys))
+        for index, name, title, sections, hack, step_keys in data
+    )
+
+def save_plan(tasks, progress):
+    """Persist a new plan under this browser's plan token (kept in the URL)"""
+    token = st.query_params.get("plan") or uuid.uuid4().hex
+    st.query_params["plan"] = token
+    try:
+        get_progress_store().save_plan(token, tasks, progress)
+    except sqlite3.Error as e:
+        log_entry(f"Error saving plan: {str(e)}", "ERROR")
+
+def restore_plan():
+    """Load the saved plan for this browser's token, if there is one and nothing is loaded yet"""
+    token = st.query_params.get("plan")
+    if not token or st.session_state.last_tasks is not None:
+        return
+    try:
+        saved = get_progress_store().load_plan(token)
+    except (sqlite3.Error, ValueError, TypeError) as e:
+        log_entry(f"Error restoring plan: {str(e)}", "ERROR")
+        return
+    if saved is not None:
+        st.session_state.last_tasks, st.session_state.task_progress = saved
+        log_entry(f"Restored saved plan with {len(saved[0])} tasks")
+
+def carry_over_progress(old_tasks, old_progress, new_tasks):
+    """Fresh progress for new_tasks, keeping checkbox state for tasks whose steps didn't change"""
+    progress = TaskProgress(uuid.uuid4().hex[:12], [len(task.step_keys) for task in new_tasks])
+    if not old_tasks or old_progress is None:
+        return progress
+    
+    def signature(task):
+        return task.name, tuple(step.label for section in task.sections for step in section.steps)
+    
+    old_positions = {signature(task): task_pos for task_pos, task in enumerate(old_tasks)}
+    carried = 0
+    for task_pos, task in enumerate(new_tasks):
+        old_pos = old_positions.get(signature(task))
+        if old_pos is not None and old_progress.completed_count(old_pos):
+            progress.steps[task_pos] = array('B', old_progress.steps[old_pos])
+            progress.completed[task_pos] = old_progress.completed_count(old_pos)
+            carried += 1
+    if carried:
+        log_entry(f"Carried over progress for {carried} unchanged tasks")
+    return progress
+
+def normalize_tasks(raw_tasks):
+    """Turn the model's task dict into an immutable tuple of Task records"""
+    tasks = []
+    for task_name, modes in raw_tasks.items():
+        if not isinstance(modes, dict):
+            log_entry(f"Skipping task {task_name!r} with unexpected format", "WARNING")
+            continue
+        task_index = len(tasks) + 1
+        sections = []
+        
+        # Robotic Mode: numbered steps
+        robotic_key = next((key for key in modes.keys() if key.startswith("Robotic Mode")), None)
+        if robotic_key and isinstance(modes[robotic_key], list):
+            steps = []
+            for i, step in enumerate(modes[robotic_key]):
+                # Check if step already starts with a number (like "1.")
+                if re.match(r'^\d+\.', step.strip()):
+                    # Already has a number, escape it so markdown doesn't renumber
+                    display_step = re.sub(r'^(\d+)\.', r'\1\\.', step.strip())
+                else:
+                    # Add the number (i+1 to start from 1 instead of 0)
+                    display_step = f"{i+1}. {step}"
+                steps.append(TaskStep(f"task_{task_index}_robotic_{i}", display_step))
+            sections.append(TaskSection(robotic_key.rstrip(':'), tuple(steps)))
+        
+        # Creative Mode: bulleted options shown as is
+        creative_key = next((key for key in modes.keys() if key.startswith("Creative Mode")), None)
+        if creative_key and isinstance(modes[creative_key], list):
+            steps = tuple(TaskStep(f"task_{task_index}_creative_{i}", step) for i, step in enumerate(modes[creative_key]))
+            sections.append(TaskSection(creative_key.rstrip(':'), steps))
+        
+        # Activation Hack (rendered differently - as a callout)
+        hack = None
+        if "Activation Hack" in modes:
+            hack = str(modes["Activation Hack"]).replace('⚡ **Activation Hack:**', '')
+        
+        tasks.append(Task(
+            index=task_index,
+            name=task_name,
+            title=format_task_name(task_name),
+            sections=tuple(sections),
+            hack=hack,
+            step_keys=tuple(step.key for section in sections for step in section.steps),
+        ))
+    return tuple(tasks)
+
+def parse_json_response(response_text):
+    """Parse the JSON response from the API into normalized Task records"""
+    try:
+        tasks = json.loads(response_text) #loads the response text into a dictionary
+        log_entry(f"Successfully parsed JSON with {len(tasks)} tasks")
+        return normalize_tasks(tasks)
+    except json.JSONDecodeError as e:
+        log_entry(f"Error parsing JSON: {str(e)}", "ERROR")
+        
+        # Try to extract JSON if it's surrounded by backticks or other text
+        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', response_text)
+        if json_match:
+            try:
+                tasks = json.loads(json_match.group(1))
+                log_entry("Successfully extracted and parsed JSON from code block")
+                log_entry("Parsed JSON: %s", "DEBUG", args=(tasks,))
+                return normalize_tasks(tasks)
+            except json.JSONDecodeError:
+                log_entry("Error parsing JSON from code block", "ERROR")
+        
+        # Fix common mistakes and salvage every complete task from truncated output
+        tasks = repair_task_json(response_text)
+        if tasks:
+            log_entry(f"Recovered {len(tasks)} tasks from malformed response", "WARNING")
+            return normalize_tasks(tasks)
+        
+        st.error("The AI response wasn't in valid JSON format. Please try again.")
+        return None
+
+def format_task_name(task_name):
+    """Clean up a task name - remove "Task:" prefix and surrounding quotes"""
+    if task_name.startswith('Task:'):
+        task_name = task_name[5:].strip()
+    return re.sub(r'^"(.*)"$', r'\1', task_name)
+
+def render_task_preview(task_index, task_name, modes):
+    """Render a read-only task expander while the rest of the response is still streaming"""
+    with st.expander(f"**{task_index}. {format_task_name(task_name)}**", expanded=False):
+        for mode_key, steps in modes.items():
+            if isinstance(steps, list):
+                st.markdown(f"<div class='mode-header'>{mode_key.rstrip(':')}:</div>", unsafe_allow_html=True)
+                st.markdown("\n".join(f"- {step}" for step in steps))
+            elif mode_key == "Activation Hack":
+                st.markdown(f"<div class='mode-header'>Activation Hack:</div>", unsafe_allow_html=True)
+                st.markdown(f"<div class='activation-hack'>{steps}</div>", unsafe_allow_html=True)
+
+def is_task_done(progress, task):
+    total_subtasks = progress.total_count(task.index - 1)
+    return total_subtasks > 0 and progress.completed_count(task.index - 1) == total_subtasks
+
+def render_completed_summary(tasks):
+    """Collapse fully completed tasks into one compact table instead of a widget per task"""
+    progress = st.session_state.task_progress
+    st.markdown(f"#### ✅ Completed ({len(tasks)})")
+    st.dataframe(
+        [{"#": task.index, "Task": task.title, "Steps": progress.total_count(task.index - 1)} for task in tasks],
+        hide_index=True,
+        use_container_width=True,
+    )
+
+@st.fragment
+def render_task(task):
+    """Render one task's header button and, only while it's expanded, its checkboxes and progress bar"""
+    log_entry("Displaying task: %s", "DEBUG", args=(task.name,))
+    task_index = task.index
+    task_pos = task_index - 1
+    progress = st.session_state.task_progress
+    
+    # Count total and completed subtasks
+    total_subtasks = progress.total_count(task_pos)
+    completed_subtasks = progress.completed_count(task_pos)
+    done = total_subtasks > 0 and completed_subtasks == total_subtasks
+    
+    # Move a task that was just completed into the summary table
+    if done and not st.session_state.get("show_completed", False):
+        log_entry(f"Task {task_index} is fully completed ({completed_subtasks}/{total_subtasks})")
+        st.rerun()
+    
+    # The steps' widgets only exist while the task is expanded, so collapsed tasks cost one button each
+    task_key = f"{progress.response_id}_{task_index}"
+    expanded = st.session_state.expanded_tasks.get(task_key, False)
+    st.button(
+        f"{'▼' if expanded else '▶'} {'✅ ' if done else ''}**{task_index}. {task.title}** ({completed_subtasks}/{total_subtasks})",
+        key=f"task_header_{task_key}",
+        on_click=task_callback,
+        args=(task_key,),
+        use_container_width=True
+    )
+    if not expanded:
+        return
+    
+    with st.container(border=True):
+        step_pos = 0
+        for header, steps in task.sections:
+            st.markdown(f"<div class='mode-header'>{header}:</div>", unsafe_allow_html=True)
+            for step_key, label in steps:
+                st.checkbox(
+                    label,
+                    key=f"{progress.response_id}_{step_key}",
+                    value=progress.is_done(task_pos, step_pos),
+                    on_change=checkbox_callback,
+                    args=(progress.response_id, task_pos, step_pos)
+                )
+                step_pos += 1
+        
+        if task.hack is not None:
+            st.markdown(f"<div class='mode-header'>Activation Hack:</div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='activation-hack'>{task.hack}</div>", unsafe_allow_html=True)
+        
+        # Display completion status
+        if total_subtasks > 0:
+            completion_percentage = int((completed_subtasks / total_subtasks) * 100)
+            st.progress(completion_percentage / 100)
+            st.markdown(f"**{completed_subtasks}/{total_subtasks}** subtasks completed ({completion_percentage}%)")
+
+def render_validation(validation):
+    st.markdown(f"""<div style="background-color: #f8f9fa; padding: 15px; 
+                border-radius: 10px; margin-bottom: 20px; border-left: 4px solid #4CAF50;">
+                {validation}</div>""", unsafe_allow_html=True)
+
+def finish_job(job):
+    """Turn a finished job into this session's plan: report timings, parse, carry over progress and save"""
+    try:
+        response = job.breakdown_future.result()
+        log_entry(f"Response received in {time.time() - job.created:.2f} seconds", "SUCCESS")
+        log_entry(f"Raw response: {response[:100]}...", "DATA")
+    except Exception as e:
+        error_msg = str(e)
+        log_entry(f"API Error: {error_msg}", "ERROR")
+        st.session_state.last_error = f"API Error: {error_msg}"
+        response = f"I couldn't process your request due to an error. Please try again. Error: {error_msg}"
+    try:
+        st.session_state.last_validation = job.validation_future.result()
+    except Exception as e:
+        log_entry(f"Error getting emotional validation: {str(e)}", "ERROR")
+        st.session_state.last_validation = None
+    
+    # Report wall-clock time per stage
+    stage_timings = dict(job.stage_timings, total=(job.finished or time.time()) - job.created)
+    get_metrics().observe("total", stage_timings["total"])
+    for stage, seconds in stage_timings.items():
+        log_entry(f"Stage '{stage}' took {seconds:.2f} seconds", "TIMING")
+    log_entry(f"OpenAI connection pool: {get_connection_stats().summary()}", "API")
+    
+    # Store the raw response in session state for logging
+    st.session_state.raw_model_response = response
+    
+    # Parse the JSON response
+    tasks = timed_stage("parse", parse_json_response, response)
+    log_entry("Tasks: %s", "DEBUG", args=(tasks,))
+    
+    if tasks:
+        # Save the tasks in session state, with fresh progress tied to this response
+        # (tasks that are unchanged from the previous plan keep their progress)
+        st.session_state.task_progress = carry_over_progress(
+            st.session_state.last_tasks, st.session_state.task_progress, tasks)
+        st.session_state.last_tasks = tasks
+        st.session_state.tasks_visible = TASKS_PAGE_SIZE
+        log_entry("Reset task states for new prompt")
+        save_plan(tasks, st.session_state.task_progress)
+    elif "last_error" not in st.session_state:
+        st.session_state.last_error = "The AI response wasn't in valid JSON format. Please try again."
+    get_metrics().write()
+
+@st.fragment(run_every=JOB_POLL_INTERVAL_SECONDS)
+def render_job_progress(job_id):
+    """Poll a background job: show its place in line, the validation and streamed tasks,
+    and once it's done load the plan and rerun the page"""
+    job = get_job_manager().get(job_id)
+    if job is None or job.done():
+        if job is None:
+            log_entry(f"Job {job_id} is gone (finished too long ago or the server restarted)", "WARNING")
+        else:
+            finish_job(job)
+        st.session_state.active_job = None
+        st.query_params.pop("job", None)
+        st.rerun()
+    
+    # Let the user know when they're waiting in line for the API
+    position = get_llm_scheduler().queue_position(job.session_id)
+    dots = "⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏"
+    spinner = dots[int((time.time() - job.created) / JOB_POLL_INTERVAL_SECONDS) % len(dots)]
+    status = f"⏳ Lots of people are planning right now, you're #{position} in line..." if position > 1 else f"{spinner} Generating response... "
+    if job.validation_future.done() and not job.validation_future.exception() and job.validation_future.result():
+        render_validation(job.validation_future.result())
+    st.markdown(f"<h3>{status}</h3>", unsafe_allow_html=True)
+    for preview_index, (task_name, modes) in enumerate(list(job.streamed), 1):
+        render_task_preview(preview_index, task_name, modes)
+
+# Seconds spent importing this module (and, once a client exists, openai), for the startup report
+STARTUP_TIMINGS = {"core_import": time.perf_counter() - _import_start}